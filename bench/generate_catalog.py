@@ -0,0 +1,179 @@
+"""
+Write a synthetic beiradar.db catalog for benchmarking.
+
+Names, sizes, prices and store coverage are modelled on the real catalog
+(the repo's beiradar.db): each category keeps its own brands, descriptors,
+pack sizes and price per unit, topped up with made-up brands so large
+catalogs stay unique. The result goes through schema.migrate, so it has the
+same search index, price columns and deals as a seeded database.
+
+    python bench/generate_catalog.py --rows 100000 --out bench/data/catalog-100k.db
+"""
+import argparse
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+from itertools import islice
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import connect_writer  # noqa: E402
+from schema import (PRODUCT_COLUMN_NAMES, PRODUCT_COLUMN_SQL, STORES, create_products_table,  # noqa: E402
+                    migrate, product_key, typed_product)
+from scrape_parser import parse_weight, quantity  # noqa: E402
+from snapshot_file import snapshot_path, write_snapshot  # noqa: E402
+
+SOURCE_DB = os.path.join(ROOT, 'beiradar.db')
+PRESETS = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+BATCH_SIZE = 10_000
+
+# Share of products on promotion at a store that lists them
+PROMO_RATE = 0.35
+
+_SYLLABLES = ['ka', 'ri', 'mo', 'na', 'zu', 'le', 'ta', 'bo', 'si', 've', 'du', 'ra', 'mi', 'ko', 'fa', 'ni']
+_SIZE_WORD_RE = re.compile(r"^\d|^(kg|g|ml|l|ltrs?|pcs|pack|pk|'?s)$", re.IGNORECASE)
+
+
+class CategoryModel:
+    """Vocabulary, pack sizes and prices of one real category."""
+
+    def __init__(self, name):
+        self.name = name
+        self.brands = []
+        self.descriptors = set()
+        self.weights = []
+        self.unit_prices = []
+        self.images = []
+
+    def add(self, row):
+        words = [w for w in re.sub(r'\s*[-–]\s*', ' ', row['product']).split() if not _SIZE_WORD_RE.match(w)]
+        if not words:
+            return
+        self.brands.append(words[0])
+        self.descriptors.update(words[1:])
+        weight = row['weight'] or parse_weight(row['product'])
+        size = quantity(weight)
+        if size:
+            self.weights.append(weight)
+            prices = [row[f'{store.lower()}_current'] for store in STORES]
+            self.unit_prices.extend(p / size[0] for p in prices if p)
+        if row['image_url']:
+            self.images.append(row['image_url'])
+
+
+def load_models(source_db=SOURCE_DB):
+    conn = sqlite3.connect(source_db)
+    conn.row_factory = sqlite3.Row
+    by_name = {}
+    for row in conn.execute("SELECT * FROM products"):
+        model = by_name.setdefault(row['category'], CategoryModel(row['category']))
+        model.add(row)
+    conn.close()
+    return [m for m in by_name.values() if m.weights and m.unit_prices and m.descriptors]
+
+
+def made_up_brand(rng):
+    return ''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+
+
+def store_coverage(source_db=SOURCE_DB):
+    """Share of products each store has a price for in the real catalog."""
+    conn = sqlite3.connect(source_db)
+    total = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] or 1
+    coverage = {}
+    for store in STORES:
+        listed = conn.execute(f"SELECT COUNT(*) FROM products WHERE {store.lower()}_current > 0").fetchone()[0]
+        coverage[store] = listed / total
+    conn.close()
+    return coverage
+
+
+def generate_rows(count, models, coverage, seed=0):
+    """Yield count unique products rows as tuples in schema.PRODUCT_COLUMNS order."""
+    rng = random.Random(seed)
+    # Roughly one extra brand per 25 products per category keeps names unique
+    extra_brands = {m.name: [made_up_brand(rng) for _ in range(max(1, count // (25 * len(models))))] for m in models}
+    descriptors = {m.name: sorted(m.descriptors) for m in models}
+    seen = set()
+
+    while len(seen) < count:
+        model = rng.choice(models)
+        brand = rng.choice(model.brands) if rng.random() < 0.2 else rng.choice(extra_brands[model.name])
+        words = rng.sample(descriptors[model.name], min(len(descriptors[model.name]), rng.randint(1, 3)))
+        weight = rng.choice(model.weights)
+        name = ' '.join([brand] + words + [weight])
+        key = product_key(model.name, name)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        size = quantity(weight)[0]
+        base = rng.choice(model.unit_prices) * size
+        row = {'product': name, 'weight': weight, 'category': model.name, 'product_key': key}
+        cheapest = None
+        # Every real product is listed by at least one store
+        listed = [store for store in STORES if rng.random() <= coverage[store]] or [rng.choice(STORES)]
+        for store in STORES:
+            s = store.lower()
+            row[f'{s}_current'] = row[f'{s}_original'] = row[f'{s}_discount_%'] = None
+            if store not in listed:
+                continue
+            current = round(base * rng.uniform(0.85, 1.15))
+            row[f'{s}_current'] = float(current)
+            if rng.random() < PROMO_RATE:
+                discount = rng.uniform(0.05, 0.3)
+                original = round(current / (1 - discount))
+                row[f'{s}_original'] = float(original)
+                row[f'{s}_discount_%'] = round((original - current) / original, 4)
+            if cheapest is None or current < cheapest[0]:
+                cheapest = (float(current), store)
+        row['cheapest_price'], row['cheapest_store'] = cheapest or (None, None)
+        row['image_url'] = rng.choice(model.images) if model.images and rng.random() < 0.5 else ''
+        row['is_discounted_anywhere'] = 1
+        yield tuple(typed_product(row).values())
+
+
+def write_catalog(path, count, seed=0, source_db=SOURCE_DB):
+    models = load_models(source_db)
+    coverage = store_coverage(source_db)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    conn = connect_writer(path)
+    create_products_table(conn)
+    insert = f"INSERT INTO products ({PRODUCT_COLUMN_SQL}) VALUES ({', '.join('?' * len(PRODUCT_COLUMN_NAMES))})"
+
+    rows = generate_rows(count, models, coverage, seed)
+    conn.execute("BEGIN")
+    while True:
+        batch = list(islice(rows, BATCH_SIZE))
+        if not batch:
+            break
+        conn.executemany(insert, batch)
+    conn.commit()
+
+    migrate(conn)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    write_snapshot(conn, snapshot_path(path))
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic beiradar.db catalog")
+    parser.add_argument('--rows', default='1k', help="product count, or one of: " + ', '.join(PRESETS))
+    parser.add_argument('--out', help="output path (default: bench/data/catalog-<rows>.db)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    count = PRESETS.get(args.rows.lower()) or int(args.rows)
+    out = args.out or os.path.join(ROOT, 'bench', 'data', f'catalog-{args.rows.lower()}.db')
+
+    started = time.perf_counter()
+    write_catalog(out, count, args.seed)
+    print(f"Wrote {count:,} products to {out} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,245 @@
+"""
+Drive webapp.py through its main views with the Flask test client and
+report per-scenario p50/p95/p99 latency, throughput and peak RSS as JSON.
+
+    python bench/generate_catalog.py --rows 100k
+    python bench/run_bench.py --db bench/data/catalog-100k.db
+    python bench/run_bench.py --db bench/data/catalog-100k.db --baseline bench/results/<older>.json
+
+Each result file records the commit it ran against, so two runs can be
+compared with --baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+SCENARIOS = ['search', 'autocomplete', 'subcategory', 'deals', 'cart']
+CART_ITEMS = 5
+
+
+# WORKLOAD
+
+class Workload:
+    """Random but realistic request URLs, drawn from the catalog being benchmarked."""
+
+    def __init__(self, db_path, seed=0):
+        self.rng = random.Random(seed)
+        conn = sqlite3.connect(db_path)
+        names = [row[0] for row in conn.execute("SELECT product FROM products ORDER BY random() LIMIT 2000")]
+        self.words = sorted({w.lower() for name in names for w in name.split() if w.isalpha() and len(w) > 2})
+        self.categories = [row[0] for row in conn.execute("SELECT DISTINCT category FROM products")]
+        self.product_ids = [row[0] for row in conn.execute("SELECT rowid FROM products ORDER BY random() LIMIT 500")]
+        self.prices = sorted(row[0] for row in conn.execute(
+            "SELECT best_price FROM products WHERE best_price IS NOT NULL ORDER BY random() LIMIT 500"
+        ))
+        conn.close()
+
+    def price_range(self):
+        low, high = sorted(self.rng.sample(self.prices, 2))
+        return int(low), int(high) + 1
+
+    def search(self):
+        params = {'search': ' '.join(self.rng.sample(self.words, self.rng.choice([1, 1, 2])))}
+        if self.rng.random() < 0.3:
+            params['min_price'], params['max_price'] = self.price_range()
+        return f"/?{urlencode(params)}"
+
+    def autocomplete(self):
+        word = self.rng.choice(self.words)
+        return f"/api/search-suggestions?q={word[:self.rng.randint(2, min(5, len(word)))]}"
+
+    def subcategory(self):
+        url = f"/products/{self.rng.choice(self.categories).replace(' ', '-')}"
+        roll = self.rng.random()
+        if roll < 0.3:
+            low, high = self.price_range()
+            url += f"?min_price={low}&max_price={high}"
+        elif roll < 0.5:
+            url += f"?min_discount={self.rng.choice([5, 10, 20])}"
+        return url
+
+    def deals(self):
+        url = f"/deals?page={self.rng.randint(1, 3)}"
+        if self.rng.random() < 0.5:
+            url += f"&store={self.rng.choice(['Carrefour', 'Naivas', 'Quickmart'])}"
+        return url
+
+    def cart(self):
+        return "/cart"
+
+    def prepare(self, client, scenario):
+        """Per-client setup before a scenario runs (the cart needs items in it)."""
+        if scenario == 'cart':
+            for product_id in self.rng.sample(self.product_ids, min(CART_ITEMS, len(self.product_ids))):
+                client.post(f"/cart/add/{product_id}", data={'quantity': 1})
+
+
+# MEASUREMENT
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def run_scenario(app, workload, scenario, requests, warmup, threads):
+    make_url = getattr(workload, scenario)
+    clients = [app.test_client() for _ in range(threads)]
+    for client in clients:
+        workload.prepare(client, scenario)
+    # URLs are drawn up front so the random generator isn't shared across threads
+    urls = [make_url() for _ in range(warmup + requests)]
+    for url in urls[:warmup]:
+        clients[0].get(url)
+
+    def worker(index):
+        client = clients[index]
+        timings, errors = [], 0
+        for url in urls[warmup + index::threads]:
+            started = time.perf_counter()
+            response = client.get(url)
+            response.get_data()
+            timings.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+        return timings, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(worker, range(threads)))
+    wall = time.perf_counter() - started
+
+    timings = sorted(t for ts, _ in results for t in ts)
+    return {
+        'requests': len(timings),
+        'errors': sum(e for _, e in results),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'throughput_rps': round(len(timings) / wall, 1),
+    }
+
+
+def load_app(db_path, page_cache=True):
+    sys.path.insert(0, ROOT)
+    from webapp import create_app
+    config = {'BEIRADAR_DB': os.path.abspath(db_path)}
+    if not page_cache:
+        config['PAGE_CACHE_ENTRIES'] = 0
+    return create_app(config)
+
+
+def run(db_path, scenarios, requests, warmup, threads, page_cache=True, seed=0):
+    started = time.perf_counter()
+    app = load_app(db_path, page_cache)
+    # create_app loads the catalog snapshot; the first request warms the rest
+    app.test_client().get('/')
+    startup = time.perf_counter() - started
+
+    workload = Workload(db_path, seed)
+    conn = sqlite3.connect(db_path)
+    products = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    conn.close()
+
+    results = {}
+    cache = app.extensions['beiradar'].page_cache
+    for scenario in scenarios:
+        hits, misses = cache.hits, cache.misses
+        stats = run_scenario(app, workload, scenario, requests, warmup, threads)
+        looked_up = (cache.hits - hits) + (cache.misses - misses)
+        stats['page_cache_hit_ratio'] = round((cache.hits - hits) / looked_up, 3) if looked_up else None
+        results[scenario] = stats
+        print(f"  {scenario:<13} p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  "
+              f"p99 {stats['p99_ms']:>8.2f} ms  {stats['throughput_rps']:>8.1f} req/s")
+
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'db': os.path.basename(db_path),
+        'products': products,
+        'settings': {'requests': requests, 'warmup': warmup, 'threads': threads, 'page_cache': page_cache, 'seed': seed},
+        'startup_s': round(startup, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'scenarios': results,
+    }
+
+
+def compare(result, baseline):
+    """Print each scenario's change against a baseline run."""
+    print(f"\nAgainst {baseline.get('commit')} ({baseline.get('db')}, {baseline.get('products')} products):")
+    for scenario, stats in result['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(scenario)
+        if not old:
+            continue
+        changes = '  '.join(
+            f"{metric} {(stats[metric] - old[metric]) / old[metric] * 100:+6.1f}%"
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps') if old.get(metric)
+        )
+        print(f"  {scenario:<13} {changes}")
+    if baseline.get('peak_rss_mb'):
+        print(f"  peak RSS      {result['peak_rss_mb']} MB (was {baseline['peak_rss_mb']} MB)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark webapp.py against a catalog database")
+    parser.add_argument('--db', default=os.path.join(ROOT, 'bench', 'data', 'catalog-1k.db'))
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma separated: " + ', '.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help="timed requests per scenario")
+    parser.add_argument('--warmup', type=int, default=50, help="untimed requests per scenario")
+    parser.add_argument('--threads', type=int, default=1, help="concurrent clients")
+    parser.add_argument('--no-page-cache', action='store_true', help="render every page instead of serving cached ones")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="result file (default: bench/results/<db>-<commit>.json)")
+    parser.add_argument('--baseline', help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    print(f"Benchmarking {args.db}")
+    result = run(args.db, scenarios, args.requests, args.warmup, args.threads, not args.no_page_cache, args.seed)
+    print(f"  startup {result['startup_s']} s, peak RSS {result['peak_rss_mb']} MB")
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{os.path.splitext(result['db'])[0]}-{result['commit'] or 'nocommit'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(result, json.load(f))
@@ -0,0 +1,167 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from db import ReadPool
+from price_history import lowest_prices, price_trajectory
+from pricing import PriceTable
+from schema import catalog_generation, find_deals, find_product_ids, find_product_page, match_ids
+from snapshot_file import MappedSnapshot, snapshot_path
+
+DB_PATH = 'beiradar.db'
+
+
+class CatalogSnapshot:
+    """A read-only copy of the products table taken at one point in time."""
+
+    __slots__ = ('version', 'last_modified', 'products', 'by_id', 'categories', 'prices', '_position')
+
+    def __init__(self, version, products, last_modified=None):
+        self.version = version
+        self.last_modified = last_modified
+        self.products = tuple(products)
+        self.by_id = {p['id']: p for p in self.products}
+        # Store prices as columns, row i belonging to products[i]
+        self.prices = PriceTable.from_products(self.products)
+        self.categories = tuple(sorted({p['category'] for p in self.products if p.get('category') is not None}))
+        self._position = {id(p): i for i, p in enumerate(self.products)}
+
+    def column(self, name):
+        """Every row's value of one column."""
+        return [p.get(name) for p in self.products]
+
+    def positions(self, products):
+        """
+        Return the row positions of products in this snapshot, or None if
+        any of them is not one of its rows.
+        """
+        position = self._position
+        try:
+            return [position[id(p)] for p in products]
+        except KeyError:
+            return None
+
+
+class Catalog:
+    """
+    Read-mostly, in-memory view of the products table.
+    The table is loaded once and reloaded (then swapped in atomically)
+    only when its rows change (schema.catalog_generation) or a new snapshot
+    file is written. When ingest has written a
+    snapshot file (snapshot_file.py) it is mapped instead of loading the
+    table, so every worker process shares the same pages, unless the
+    table has changed since the file was written.
+    hits/misses count snapshot() calls served as is / that had to reload.
+    """
+
+    def __init__(self, db_path=DB_PATH, connection_factory=sqlite3.Connection, snapshot_file=None):
+        self.db_path = db_path
+        self.snapshot_file = snapshot_file or snapshot_path(db_path)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.pool = ReadPool(db_path, connection_factory)
+        self.hits = 0
+        self.misses = 0
+
+    def _db_version(self):
+        # The products generation only moves when products rows change
+        # (schema.ensure_catalog_generation), not on writes to other tables,
+        # WAL checkpoints or a running seed's uncommitted pages. A new snapshot
+        # file replaces the old one, so it shows up as a new inode.
+        generation = catalog_generation(self.pool.connection())
+        try:
+            snapshot_inode = os.stat(self.snapshot_file).st_ino
+        except FileNotFoundError:
+            snapshot_inode = None
+        if generation is None:
+            # A database from before the generation was kept: any write to it
+            generation = tuple(self._file_stat(path) for path in (self.db_path, self.db_path + '-wal'))
+        return generation, snapshot_inode
+
+    @staticmethod
+    def _file_stat(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _load(self, version):
+        generation, snapshot_inode = version
+        stats = [self._file_stat(path) for path in (self.db_path, self.db_path + '-wal', self.snapshot_file)]
+        mtime_ns = max(st[1] for st in stats if st is not None)
+        last_modified = datetime.fromtimestamp(mtime_ns // 1_000_000_000, tz=timezone.utc)
+        if snapshot_inode is not None:
+            try:
+                snap = MappedSnapshot(self.snapshot_file, version, last_modified)
+            except (OSError, ValueError):
+                pass    # not a snapshot file (e.g. an older format); load the table
+            else:
+                # Products changed since the file was written (by a writer that
+                # didn't rewrite it) are only in the table
+                if snap.generation == generation:
+                    return snap
+
+        cursor = self.pool.connection().execute("SELECT rowid AS id, * FROM products ORDER BY rowid")
+        names = [d[0] for d in cursor.description]
+        products = (dict(zip(names, row)) for row in cursor.fetchall())
+        return CatalogSnapshot(version, products, last_modified)
+
+    def snapshot(self):
+        """Return the current snapshot, reloading it if the database changed."""
+        version = self._db_version()
+        snap = self._snapshot
+        if snap is not None and snap.version == version:
+            self.hits += 1
+            return snap
+
+        with self._lock:
+            snap = self._snapshot
+            if snap is None or snap.version != version:
+                self.misses += 1
+                snap = self._load(version)
+                self._snapshot = snap
+            else:
+                self.hits += 1
+        return snap
+
+    def find(self, **filters):
+        """
+        Return products matching the filters accepted by schema.find_product_ids.
+        The database only resolves matching ids; rows come from the snapshot.
+        """
+        by_id = self.snapshot().by_id
+        ids = find_product_ids(self.pool.connection(), **filters)
+        return [by_id[i] for i in ids if i in by_id]
+
+    def match_ids(self, search_query):
+        """Return the ids of every product the search text matches, see schema.match_ids."""
+        return match_ids(self.pool.connection(), search_query)
+
+    def find_page(self, limit, after=None, offset=0, **filters):
+        """
+        Return (products, last_key, total) for one page of find() results,
+        see schema.find_product_page.
+        """
+        by_id = self.snapshot().by_id
+        ids, last_key, total = find_product_page(self.pool.connection(), limit, after, offset, **filters)
+        return [by_id[i] for i in ids if i in by_id], last_key, total
+
+    def deals(self, store=None, category=None, limit=None, offset=0):
+        """
+        Return (deals, total) from the materialized deals table; each deal
+        dict also carries its catalog row under 'product'.
+        """
+        by_id = self.snapshot().by_id
+        deals, total = find_deals(self.pool.connection(), store, category, limit, offset)
+        for deal in deals:
+            deal['product'] = by_id.get(deal['product_id'], {})
+        return deals, total
+
+    def lowest_prices(self, product_keys, days=30):
+        """{product_key: (lowest price, store)} over the last days days, from the price history."""
+        return lowest_prices(self.pool.connection(), product_keys, days)
+
+    def price_trajectory(self, product_key, days=30):
+        return price_trajectory(self.pool.connection(), product_key, days)
@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+# Per-connection tuning for the read path
+CACHE_SIZE_KIB = 16 * 1024          # page cache per connection
+MMAP_SIZE = 256 * 1024 * 1024       # let reads come straight from the OS page cache
+STATEMENT_CACHE = 256               # prepared statements kept per connection
+
+
+def connect_readonly(db_path, factory=sqlite3.Connection):
+    """
+    Open a read-only, tuned connection. With the database in WAL mode
+    these never block on (or get blocked by) a running seed. factory is
+    the sqlite3.Connection subclass to open (e.g. an instrumented one).
+    """
+    uri = Path(db_path).resolve().as_uri() + '?mode=ro'
+    # sqlite3 reuses a prepared statement whenever the same SQL text runs again.
+    # Each pooled connection is only used by its own thread; the check is
+    # relaxed so ReadPool.close() can close them all from one place.
+    conn = sqlite3.connect(uri, uri=True, cached_statements=STATEMENT_CACHE, check_same_thread=False,
+                           factory=factory)
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def connect_writer(db_path):
+    """Open a read-write connection and switch the database to WAL mode."""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+class ReadPool:
+    """
+    One read-only connection per thread, opened on first use and reused
+    for every later query on that thread. A forked worker (e.g. under a
+    preloading WSGI server) opens its own instead of using its parent's.
+    """
+
+    def __init__(self, db_path, factory=sqlite3.Connection):
+        self.db_path = db_path
+        self.factory = factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._pid = os.getpid()
+
+    def connection(self):
+        if self._pid != os.getpid():
+            # SQLite connections must not cross a fork; the parent's are left alone
+            self._pid = os.getpid()
+            self._local = threading.local()
+            self._lock = threading.Lock()
+            self._connections = []
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect_readonly(self.db_path, self.factory)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Close every pooled connection (e.g. at worker shutdown)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
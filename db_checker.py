@@ -80,9 +80,35 @@ def check_database():
     conn.close()
     print("\n" + "=" * 60)
 
+def check_facets(db_path=DB_PATH):
+    """Check that every price facet's count equals the length of the listing its link produces"""
+    from catalog import Catalog
+    from facets import Facets
+
+    catalog = Catalog(db_path)
+    facets = Facets(catalog)
+    index = facets.index()
+
+    print("FACET COUNTS")
+    mismatches = 0
+    for category in [None] + index.categories:
+        for f in facets.counts(category=category)['price']:
+            _, _, total = catalog.find_page(1, category=category, min_price=f['min_price'], max_price=f['max_price'])
+            selected = len(index.select(category=category, min_price=f['min_price'], max_price=f['max_price']))
+            if f['count'] != total or f['count'] != selected:
+                mismatches += 1
+                print(f"❌ {category or 'All'} / KSh {f['label']}: count {f['count']}, "
+                      f"listing {total}, index {selected}")
+    catalog.pool.close()
+
+    if not mismatches:
+        print(f"✓ Price facet counts match their listings ({len(index.categories) + 1} listings checked)")
+    print("=" * 60)
+
 if __name__ == '__main__':
     try:
         check_database()
+        check_facets()
     except sqlite3.OperationalError as e:
         print(f"❌ ERROR: Could not connect to database")
         print(f"   {e}")
@@ -0,0 +1,186 @@
+import threading
+
+import numpy as np
+
+from schema import STORES
+
+# Upper bounds (KSh) of the best-price buckets; the last bucket is open ended.
+# Buckets are half-open (low <= price < high), the same range a facet link's
+# min_price/max_price filter applies
+PRICE_BUCKETS = (100, 250, 500, 1000, 2500)
+# min_discount thresholds (%) counted by the discount facet
+DISCOUNT_THRESHOLDS = (5, 10, 20, 30)
+
+# Category pages group the catalog's categories into departments; categories
+# the taxonomy doesn't name yet are listed under OTHER_DEPARTMENT
+DEPARTMENTS = {
+    'Foodstuff': ['rice', 'oil', 'sugar'],
+    'Dairy': ['milk', 'yoghurt', 'cheese'],
+    'Household': ['laundry', 'dishwashing', 'paper products'],
+    'Personal Care': ['toothpastes', 'lotion', 'sanitary pads'],
+}
+OTHER_DEPARTMENT = 'Other'
+
+
+def slugify(name):
+    """URL slug of a category or department name, e.g. 'Paper products' -> 'paper-products'."""
+    return '-'.join((name or '').lower().replace('_', ' ').split())
+
+
+def display_name(category):
+    return (category or '').replace('_', ' ').title()
+
+
+def _price_labels():
+    labels = [f"Under {PRICE_BUCKETS[0]:,}"]
+    labels += [f"{low:,} – {high:,}" for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:])]
+    return labels + [f"{PRICE_BUCKETS[-1]:,}+"]
+
+
+class FacetIndex:
+    """
+    Per-product facet codes for one catalog snapshot, in snapshot row order:
+    category, best store, price bucket and discount bucket, plus each
+    category's row positions. Counting a result set is one bincount per
+    facet over its positions; filters without search text are answered
+    from these arrays without touching SQLite.
+    """
+
+    def __init__(self, version, ids, categories, best_price, best_store_idx, max_discount):
+        self.version = version
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.best_price = np.asarray(best_price, dtype=np.float64)
+        self.max_discount = np.nan_to_num(np.asarray(max_discount, dtype=np.float64))
+
+        self.categories = sorted({c for c in categories if c is not None})
+        codes = {c: i for i, c in enumerate(self.categories)}
+        self.category_codes = np.array([codes.get(c, -1) for c in categories], dtype=np.int32)
+        order = np.argsort(self.category_codes, kind='stable')
+        bounds = np.searchsorted(self.category_codes[order], np.arange(len(self.categories) + 1))
+        self.category_positions = {c: order[bounds[i]:bounds[i + 1]] for i, c in enumerate(self.categories)}
+        self._by_slug = {slugify(c): c for c in self.categories}
+
+        # -1 (no price, or the same price everywhere) is counted in the extra last slot
+        self.store_codes = np.where(best_store_idx < 0, len(STORES), best_store_idx).astype(np.int32)
+        # Products without a price get the extra last bucket
+        buckets = np.searchsorted(PRICE_BUCKETS, self.best_price, side='right')
+        self.price_codes = np.where(np.isnan(self.best_price), len(PRICE_BUCKETS) + 1, buckets).astype(np.int32)
+        self.discount_codes = np.searchsorted(DISCOUNT_THRESHOLDS, self.max_discount, side='right').astype(np.int32)
+
+        self.category_totals = dict(zip(self.categories, np.bincount(
+            self.category_codes[self.category_codes >= 0], minlength=len(self.categories)).tolist()))
+
+    @classmethod
+    def from_snapshot(cls, snap):
+        return cls(snap.version, snap.column('id'), snap.column('category'), snap.prices.best_price,
+                   snap.prices.best_store_idx,
+                   [np.nan if v is None else v for v in snap.column('max_discount_pct')])
+
+    def category_for_slug(self, slug):
+        """The catalog category whose slug is slug, or None."""
+        return self._by_slug.get(slug)
+
+    def positions(self, ids):
+        """Row positions of product ids; ids not in the snapshot are dropped."""
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, ids).clip(max=max(len(self.ids) - 1, 0))
+        return positions[self.ids[positions] == ids] if len(self.ids) else positions[:0]
+
+    def select(self, positions=None, category=None, min_price=None, max_price=None, min_discount=None):
+        """
+        Narrow positions (default: every row) down to the products matching
+        schema.product_query's filters; without positions a category starts
+        from that category's rows.
+        """
+        if category is not None:
+            key = next((c for c in self.categories if c.lower() == category.lower()), None)
+            if positions is None:
+                positions = self.category_positions.get(key, np.empty(0, dtype=np.intp))
+            else:
+                positions = positions[self.category_codes[positions] == self.categories.index(key)] if key else positions[:0]
+        elif positions is None:
+            positions = np.arange(len(self.ids))
+
+        # min_price <= price < max_price; NaN (no price) fails both comparisons
+        price = self.best_price[positions]
+        keep = np.ones(len(positions), dtype=bool)
+        if min_price is not None:
+            keep &= price >= min_price
+        if max_price is not None:
+            keep &= price < max_price
+        if min_discount is not None:
+            keep &= self.max_discount[positions] >= min_discount
+        return positions[keep]
+
+    def counts(self, positions):
+        """Every facet's counts for the products at positions."""
+        categories = np.bincount(self.category_codes[positions] + 1, minlength=len(self.categories) + 1)[1:]
+        stores = np.bincount(self.store_codes[positions], minlength=len(STORES) + 1)
+        prices = np.bincount(self.price_codes[positions], minlength=len(PRICE_BUCKETS) + 2)
+        discounts = np.bincount(self.discount_codes[positions], minlength=len(DISCOUNT_THRESHOLDS) + 1)
+        # "at least N%" counts everything in its bucket and the ones above
+        at_least = np.cumsum(discounts[::-1])[::-1][1:]
+
+        bounds = (None,) + PRICE_BUCKETS + (None,)
+        return {
+            'total': int(len(positions)),
+            'categories': [
+                {'name': display_name(c), 'category': c, 'slug': slugify(c), 'count': n}
+                for c, n in zip(self.categories, categories.tolist()) if n
+            ],
+            'best_store': [
+                {'store': store, 'count': n} for store, n in zip(STORES, stores[:len(STORES)].tolist())
+            ],
+            'price': [
+                {'label': label, 'min_price': low, 'max_price': high, 'count': n}
+                for label, low, high, n in zip(_price_labels(), bounds, bounds[1:], prices.tolist())
+            ],
+            'discount': [
+                {'label': f"{threshold}%+", 'min_discount': threshold, 'count': n}
+                for threshold, n in zip(DISCOUNT_THRESHOLDS, at_least.tolist())
+            ],
+        }
+
+    def departments(self):
+        """[(department, [(category, product count), ...]), ...] over the catalog's categories."""
+        listed = set()
+        departments = []
+        for department, categories in list(DEPARTMENTS.items()) + [(OTHER_DEPARTMENT, self.categories)]:
+            present = [(c, self.category_totals[c]) for c in categories if c in self.category_totals and c not in listed]
+            listed.update(c for c, _ in present)
+            if present:
+                departments.append((department, present))
+        return departments
+
+
+class Facets:
+    """
+    Facet counts over a catalog.Catalog. The index is rebuilt whenever the
+    catalog snapshot changes. A search asks the FTS index for its matches
+    once; every filter and count after that runs on the index arrays.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._index = None
+        self._lock = threading.Lock()
+
+    def index(self):
+        """Return the facet index for the current catalog snapshot."""
+        snap = self.catalog.snapshot()
+        index = self._index
+        if index is not None and index.version == snap.version:
+            return index
+
+        with self._lock:
+            index = self._index
+            if index is None or index.version != snap.version:
+                index = FacetIndex.from_snapshot(snap)
+                self._index = index
+        return index
+
+    def counts(self, search_query=None, **filters):
+        """Facet counts for the products matching schema.product_query's filters."""
+        index = self.index()
+        positions = index.positions(self.catalog.match_ids(search_query)) if search_query else None
+        return index.counts(index.select(positions, **filters))
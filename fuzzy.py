@@ -0,0 +1,171 @@
+import bisect
+import threading
+from collections import Counter
+
+import numpy as np
+
+from schema import TOKEN_RE
+
+# Words shorter than this are never corrected
+MIN_WORD_LENGTH = 3
+# Candidates (best trigram overlap first) checked with edit distance per word
+MAX_CANDIDATES = 32
+# Words up to this long may share no trigram with their correction
+SHORT_WORD_LENGTH = 5
+
+# Spellings a catalog word is also searched as, both ways ('yoghurt' <-> 'yogurt').
+# Only this list: a word's one-edit neighbours are often different products
+# ('sunrise' vs 'sunrice'), not the same word spelled differently.
+SPELLING_VARIANTS = {
+    'yoghurt': 'yogurt',
+    'flavour': 'flavor',
+    'colour': 'color',
+    'fibre': 'fiber',
+}
+_VARIANTS = {**SPELLING_VARIANTS, **{v: w for w, v in SPELLING_VARIANTS.items()}}
+
+
+def max_distance(word):
+    """Edit distance a misspelling of word may be from the catalog word: 1, or 2 from six letters."""
+    return 1 if len(word) < 6 else 2
+
+
+def trigrams(word):
+    """Padded character trigrams, so the first and last letters count too: 'milk' -> #mi mil ilk lk#."""
+    padded = f"#{word}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance between a and b (a swap of two
+    neighbouring letters counts as one edit), or limit + 1 as soon as it
+    is known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class TrigramIndex:
+    """
+    Trigram posting lists over every word of the catalog's product names,
+    sizes and categories (what the FTS index holds). A query word's
+    candidates are the words sharing the most trigrams with it, so
+    correcting a typo never looks at the products themselves.
+    """
+
+    def __init__(self, version, texts):
+        self.version = version
+        frequency = Counter()
+        for text in texts:
+            frequency.update(set(TOKEN_RE.findall((text or '').lower())))
+
+        self.words = sorted(frequency)
+        self.frequency = np.array([frequency[w] for w in self.words], dtype=np.int64)
+        self.lengths = np.array([len(w) for w in self.words], dtype=np.int64)
+
+        postings = {}
+        for word_id, word in enumerate(self.words):
+            for gram in trigrams(word):
+                postings.setdefault(gram, []).append(word_id)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def has_prefix(self, word):
+        """Whether some catalog word starts with word (the FTS search would match it)."""
+        position = bisect.bisect_left(self.words, word)
+        return position < len(self.words) and self.words[position].startswith(word)
+
+    def similar(self, word, limit):
+        """
+        Catalog words within edit distance limit of word, closest first
+        (then the most common), as (word, distance) pairs.
+        """
+        grams = trigrams(word)
+        lists = [self.postings[g] for g in grams if g in self.postings]
+        overlap = np.zeros(len(self.words), dtype=np.intp)
+        if lists:
+            overlap = np.bincount(np.concatenate(lists), minlength=len(self.words))
+        near = np.abs(self.lengths - len(word)) <= limit
+        # Every edit breaks at most three trigrams
+        candidates = np.flatnonzero(near & (overlap >= max(1, len(grams) - 3 * limit)))
+        candidates = candidates[np.argsort(-overlap[candidates], kind='stable')][:MAX_CANDIDATES]
+        found = self._within(word, candidates, limit)
+        if not found and len(word) <= SHORT_WORD_LENGTH:
+            # One swap can break every trigram of a short word ('mlik'), so those
+            # are also checked against the (few) catalog words of about their length
+            found = self._within(word, np.flatnonzero(near), limit)
+        return [(w, distance) for distance, _, w in sorted(found)]
+
+    def _within(self, word, candidates, limit):
+        found = []
+        for word_id in candidates.tolist():
+            distance = edit_distance(word, self.words[word_id], limit)
+            if distance <= limit:
+                found.append((distance, -int(self.frequency[word_id]), self.words[word_id]))
+        return found
+
+
+class Corrector:
+    """
+    Typo tolerance for product search over a catalog.Catalog; the trigram
+    index is rebuilt whenever the catalog snapshot changes.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._index = None
+        self._lock = threading.Lock()
+
+    def index(self):
+        """Return the trigram index for the current catalog snapshot."""
+        snap = self.catalog.snapshot()
+        index = self._index
+        if index is not None and index.version == snap.version:
+            return index
+
+        with self._lock:
+            index = self._index
+            if index is None or index.version != snap.version:
+                texts = snap.column('product') + snap.column('weight') + list(snap.categories)
+                index = TrigramIndex(snap.version, texts)
+                self._index = index
+        return index
+
+    def expand(self, query):
+        """
+        Rewrite search text for schema.fts_query: a word no catalog word
+        starts with is replaced by its closest catalog words, and a word the
+        catalog matches is only widened by its SPELLING_VARIANTS
+        ('yogurt' -> 'yogurt|yoghurt'). Returns (search_text, corrections),
+        corrections being (word, replacement) pairs for words that had no match.
+        Text without any words comes back as is, so it still matches nothing
+        rather than reading as no search at all.
+        """
+        index = self.index()
+        terms = []
+        corrections = []
+        for word in TOKEN_RE.findall((query or '').lower()):
+            if len(word) < MIN_WORD_LENGTH or not word.isalpha():
+                terms.append(word)
+            elif index.has_prefix(word):
+                terms.append(f"{word}|{_VARIANTS[word]}" if word in _VARIANTS else word)
+            else:
+                similar = index.similar(word, max_distance(word))
+                closest = [w for w, distance in similar if distance == similar[0][1]] if similar else []
+                if closest:
+                    corrections.append((word, closest[0]))
+                terms.append('|'.join(closest) or word)
+        return ' '.join(terms) or query, corrections
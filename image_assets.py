@@ -0,0 +1,181 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+
+IMAGE_FOLDER = 'static/images'
+DERIVED_FOLDER = 'static/derived'
+MANIFEST_PATH = os.path.join(DERIVED_FOLDER, 'manifest.json')
+
+# Longest side in pixels; cards are 200px boxes, cart thumbnails 120px,
+# both rendered at up to 2x on dense screens
+SIZES = {'thumb': 240, 'card': 400}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 6},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+HASH_LENGTH = 12
+
+
+def slugify(name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-') or 'image'
+
+
+def source_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def render(img, box, fmt):
+    """Encode img scaled to fit box (never upscaled) in one of FORMATS."""
+    from PIL import Image
+
+    img = img.copy()
+    img.thumbnail((box, box), Image.LANCZOS)
+
+    if fmt == 'jpeg' and img.mode != 'RGB':
+        # JPEG has no alpha: flatten onto the white card background
+        rgba = img.convert('RGBA')
+        img = Image.new('RGB', rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.split()[-1])
+    elif img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+
+    buf = io.BytesIO()
+    img.save(buf, **FORMATS[fmt])
+    return buf.getvalue()
+
+
+def build_image(filename, source_dir=IMAGE_FOLDER, out_dir=DERIVED_FOLDER):
+    """
+    Write every size/format derivative of one source image, named
+    <slug>.<size>.<content hash>.<ext>, and return its manifest entry.
+    """
+    # Pillow is only needed to build derivatives, not to serve them
+    from PIL import Image
+
+    stem = slugify(os.path.splitext(filename)[0])
+    path = os.path.join(source_dir, filename)
+    entry = {'source': source_hash(path), 'variants': {}}
+
+    with Image.open(path) as img:
+        img.load()
+        for size, box in SIZES.items():
+            variants = {}
+            for fmt in FORMATS:
+                data = render(img, box, fmt)
+                digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+                name = f"{stem}.{size}.{digest}.{'jpg' if fmt == 'jpeg' else fmt}"
+                out_path = os.path.join(out_dir, name)
+                if not os.path.exists(out_path):
+                    with open(out_path, 'wb') as f:
+                        f.write(data)
+                variants[fmt] = name
+            entry['variants'][size] = variants
+    return entry
+
+
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build_all(source_dir=IMAGE_FOLDER, out_dir=DERIVED_FOLDER, force=False):
+    """
+    Build derivatives for every image in source_dir, skipping images whose
+    content hasn't changed since the last build, then write the manifest
+    and delete derivatives nothing refers to any more.
+    Returns (built, unchanged) counts.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    old = {} if force else load_manifest(manifest_path)
+
+    manifest = {}
+    built = unchanged = 0
+    for filename in sorted(os.listdir(source_dir)):
+        path = os.path.join(source_dir, filename)
+        if not os.path.isfile(path):
+            continue
+        key = f"images/{filename}"
+        previous = old.get(key)
+        if previous and previous['source'] == source_hash(path) and all(
+            os.path.exists(os.path.join(out_dir, name))
+            for variants in previous['variants'].values() for name in variants.values()
+        ):
+            manifest[key] = previous
+            unchanged += 1
+            continue
+        try:
+            manifest[key] = build_image(filename, source_dir, out_dir)
+        except OSError:
+            # Not an image PIL can read; it keeps being served as-is
+            continue
+        built += 1
+
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    referenced = {
+        name for entry in manifest.values()
+        for variants in entry['variants'].values() for name in variants.values()
+    }
+    for name in os.listdir(out_dir):
+        if name != 'manifest.json' and name not in referenced:
+            os.remove(os.path.join(out_dir, name))
+
+    return built, unchanged
+
+
+class ImageManifest:
+    """
+    Read side of the manifest for the web app. Reloaded when the manifest
+    file changes, so a rebuild shows up without a restart.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self._mtime = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _current(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._entries = load_manifest(self.path) if mtime else {}
+                    self._mtime = mtime
+        return self._entries
+
+    @property
+    def version(self):
+        self._current()
+        return self._mtime
+
+    def variant(self, image_path, size, fmt):
+        """Derived filename for an image_url like 'images/x.jpg', or None."""
+        entry = self._current().get(image_path)
+        if not entry:
+            return None
+        return entry['variants'].get(size, {}).get(fmt)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build resized, content-hashed product image derivatives")
+    parser.add_argument('--force', action='store_true', help="rebuild every image, even unchanged ones")
+    args = parser.parse_args()
+
+    built, unchanged = build_all(force=args.force)
+    print(f"Built {built} images, {unchanged} unchanged. Manifest: {MANIFEST_PATH}")
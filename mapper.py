@@ -1,21 +1,17 @@
 import sqlite3
 import os
 import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from difflib import SequenceMatcher
 
+from snapshot_file import snapshot_path, write_snapshot
+
 DB_PATH = 'beiradar.db'
 IMAGE_FOLDER = 'static/images'
 
-# Connect to database
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-
-# Fetch all products
-cursor.execute("SELECT product FROM products")
-products = [p[0] for p in cursor.fetchall()]
-
-# List all images in folder
-image_files = os.listdir(IMAGE_FOLDER)
+# Minimum combined score for a fuzzy (strategy 3) match
+MATCH_THRESHOLD = 0.48
 
 # Manual mappings for difficult matches
 MANUAL_MAPPINGS = {
@@ -76,109 +72,218 @@ def similarity_score(str1, str2):
     """Calculate similarity between two strings"""
     return SequenceMatcher(None, str1, str2).ratio()
 
-def find_best_image(product_name, debug=False):
-    """Find best matching image for a product"""
-    # Check manual mappings first
-    if product_name in MANUAL_MAPPINGS:
-        target_filename = MANUAL_MAPPINGS[product_name]
-        for img in image_files:
-            img_name_no_ext = os.path.splitext(img)[0]
-            if clean_text(img_name_no_ext) == clean_text(target_filename):
-                return f"images/{img}"
-            # Also try fuzzy match on manual mapping
-            if clean_text(target_filename) in clean_text(img_name_no_ext) or clean_text(img_name_no_ext) in clean_text(target_filename):
+class ImageMatcher:
+    """
+    Matches product names to image files.
+    Image names are cleaned and tokenized once, and a token -> images
+    inverted index limits the expensive scoring to images sharing at least
+    one key term with the product (an image sharing none can't reach
+    MATCH_THRESHOLD anyway). Strategy 2 looks for the product's terms as
+    substrings ('dishwash' in 'dishwashing liquid'), so its images come
+    from a character bigram -> images index instead.
+    """
+
+    def __init__(self, image_files):
+        self.images = sorted(image_files)
+        self.cleaned = [clean_text(os.path.splitext(img)[0]) for img in self.images]
+        self.tokens = [set(extract_key_terms(os.path.splitext(img)[0])) for img in self.images]
+
+        self.by_clean = {}
+        self.index = defaultdict(list)
+        self.bigrams = defaultdict(set)
+        for i, (cleaned, tokens) in enumerate(zip(self.cleaned, self.tokens)):
+            self.by_clean.setdefault(cleaned, i)
+            for token in tokens:
+                self.index[token].append(i)
+            for j in range(len(cleaned) - 1):
+                self.bigrams[cleaned[j:j + 2]].add(i)
+
+    @classmethod
+    def from_folder(cls, folder=IMAGE_FOLDER):
+        return cls(os.listdir(folder))
+
+    def _manual_match(self, product_name):
+        target = clean_text(MANUAL_MAPPINGS[product_name])
+        if target in self.by_clean:
+            return self.images[self.by_clean[target]]
+        # Also try fuzzy match on manual mapping
+        for img, cleaned in zip(self.images, self.cleaned):
+            if target in cleaned or cleaned in target:
+                return img
+        return None
+
+    def candidates(self, tokens):
+        """Images sharing at least one key term with tokens, in image order."""
+        found = set()
+        for token in tokens:
+            found.update(self.index.get(token, ()))
+        return sorted(found)
+
+    def substring_candidates(self, tokens):
+        """Images whose cleaned name has every bigram of every token, in image order."""
+        found = None
+        for token in tokens:
+            for j in range(len(token) - 1):
+                images = self.bigrams.get(token[j:j + 2], ())
+                found = set(images) if found is None else found.intersection(images)
+                if not found:
+                    return []
+        return range(len(self.images)) if found is None else sorted(found)
+
+    def find_best_image(self, product_name, debug=False):
+        """Find best matching image for a product"""
+        # Check manual mappings first
+        if product_name in MANUAL_MAPPINGS:
+            img = self._manual_match(product_name)
+            if img:
                 return f"images/{img}"
-    
-    product_clean = clean_text(product_name)
-    product_tokens = extract_key_terms(product_name)
-    
-    best_match = None
-    best_score = 0
-    
-    for img in image_files:
-        img_name = os.path.splitext(img)[0]
-        img_clean = clean_text(img_name)
-        img_tokens = extract_key_terms(img_name)
-        
+
+        product_clean = clean_text(product_name)
+        product_tokens = extract_key_terms(product_name)
+
         # Strategy 1: Exact match
-        if product_clean == img_clean:
-            return f"images/{img}"
-        
+        if product_clean in self.by_clean:
+            return f"images/{self.images[self.by_clean[product_clean]]}"
+
         # Strategy 2: All product tokens in image
-        if all(token in img_clean for token in product_tokens):
-            return f"images/{img}"
-        
-        # Strategy 3: Score-based matching
-        # Count matching tokens
-        matching_tokens = sum(1 for token in product_tokens if token in img_tokens)
-        token_ratio = matching_tokens / max(len(product_tokens), 1)
-        
-        # Calculate string similarity
-        string_sim = similarity_score(product_clean, img_clean)
-        
-        # Combined score (weighted)
-        score = (token_ratio * 0.7) + (string_sim * 0.3)
-        
-        if score > best_score and score > 0.48:  # Lowered threshold slightly
-            best_score = score
-            best_match = img
-            
-        if debug and score > 0.3:
-            print(f"  {img_name}: token_ratio={token_ratio:.2f}, string_sim={string_sim:.2f}, score={score:.2f}")
-    
-    if best_match:
-        return f"images/{best_match}"
-    
-    return None
+        for i in self.substring_candidates(product_tokens):
+            if all(token in self.cleaned[i] for token in product_tokens):
+                return f"images/{self.images[i]}"
 
-# Update database with progress tracking
-unmatched_products = []
-matched_count = 0
+        best_match = None
+        best_score = 0
 
-print("Matching products to images...\n")
+        for i in self.candidates(product_tokens):
+            img_clean = self.cleaned[i]
 
-for i, product in enumerate(products, 1):
-    image_path = find_best_image(product)
-    
-    if image_path:
-        cursor.execute("""
-            UPDATE products
-            SET image_url = ?
-            WHERE product = ?
-        """, (image_path, product))
-        matched_count += 1
-        print(f"✓ [{i}/{len(products)}] Matched: {product} → {os.path.basename(image_path)}")
-    else:
-        unmatched_products.append(product)
-        print(f"✗ [{i}/{len(products)}] No match: {product}")
-
-conn.commit()
-conn.close()
-
-# Summary
-print("\n" + "="*70)
-print(f"SUMMARY:")
-print(f"Total products: {len(products)}")
-print(f"Matched: {matched_count}")
-print(f"Unmatched: {len(unmatched_products)}")
-print("="*70)
-
-# Show unmatched products for manual review
-if unmatched_products:
-    print("\nProducts still needing manual review:")
-    for p in unmatched_products:
-        print(f" - {p}")
-        # Show debug info for unmatched
-        print(f"   Debug matches:")
-        find_best_image(p, debug=True)
-        print()
-else:
-    print("\n🎉 All products matched successfully!")
-
-# Show available images that might be good candidates
-if unmatched_products:
+            # Strategy 3: Score-based matching
+            # Count matching tokens
+            matching_tokens = sum(1 for token in product_tokens if token in self.tokens[i])
+            token_ratio = matching_tokens / max(len(product_tokens), 1)
+
+            # Calculate string similarity
+            string_sim = similarity_score(product_clean, img_clean)
+
+            # Combined score (weighted)
+            score = (token_ratio * 0.7) + (string_sim * 0.3)
+
+            if score > best_score and score > MATCH_THRESHOLD:
+                best_score = score
+                best_match = self.images[i]
+
+            if debug and score > 0.3:
+                print(f"  {os.path.splitext(self.images[i])[0]}: token_ratio={token_ratio:.2f}, string_sim={string_sim:.2f}, score={score:.2f}")
+
+        if best_match:
+            return f"images/{best_match}"
+
+        return None
+
+
+_default_matcher = None
+
+
+def find_best_image(product_name, debug=False):
+    """Find best matching image for a product, using the images in IMAGE_FOLDER"""
+    global _default_matcher
+    if _default_matcher is None:
+        _default_matcher = ImageMatcher.from_folder()
+    return _default_matcher.find_best_image(product_name, debug)
+
+
+# PARALLEL MATCHING
+
+_worker_matcher = None
+
+
+def _init_worker(image_files):
+    global _worker_matcher
+    _worker_matcher = ImageMatcher(image_files)
+
+
+def _match_in_worker(product_name):
+    return _worker_matcher.find_best_image(product_name)
+
+
+def match_products(products, matcher, workers=None):
+    """
+    Return {product: image path or None}. With workers > 1 the scoring is
+    spread over a process pool, each worker building its own index once.
+    """
+    if not workers or workers <= 1 or len(products) < 2:
+        return {product: matcher.find_best_image(product) for product in products}
+
+    chunksize = max(1, len(products) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(matcher.images,)) as pool:
+        return dict(zip(products, pool.map(_match_in_worker, products, chunksize=chunksize)))
+
+
+def update_image_urls(conn, matcher=None, workers=None, only_missing=False):
+    """
+    Match products to images and write every match back with one executemany.
+    Returns (matches, unmatched products). Doesn't commit.
+    """
+    matcher = matcher or ImageMatcher.from_folder()
+    sql = "SELECT DISTINCT product FROM products"
+    if only_missing:
+        sql += " WHERE image_url IS NULL OR image_url = ''"
+    products = [p[0] for p in conn.execute(sql) if p[0]]
+
+    matches = match_products(products, matcher, workers)
+    conn.executemany(
+        "UPDATE products SET image_url = ? WHERE product = ?",
+        [(image_path, product) for product, image_path in matches.items() if image_path]
+    )
+    unmatched = [product for product, image_path in matches.items() if not image_path]
+    return matches, unmatched
+
+
+if __name__ == '__main__':
+    # Connect to database
+    conn = sqlite3.connect(DB_PATH)
+    matcher = ImageMatcher.from_folder()
+
+    print("Matching products to images...\n")
+
+    # Update database in one pass
+    matches, unmatched_products = update_image_urls(conn, matcher, workers=os.cpu_count())
+    conn.commit()
+    write_snapshot(conn, snapshot_path(DB_PATH))
+    conn.close()
+
+    products = list(matches)
+    for i, product in enumerate(products, 1):
+        image_path = matches[product]
+        if image_path:
+            print(f"✓ [{i}/{len(products)}] Matched: {product} → {os.path.basename(image_path)}")
+        else:
+            print(f"✗ [{i}/{len(products)}] No match: {product}")
+    matched_count = len(products) - len(unmatched_products)
+
+    # Summary
     print("\n" + "="*70)
-    print("Available image files for reference:")
+    print(f"SUMMARY:")
+    print(f"Total products: {len(products)}")
+    print(f"Matched: {matched_count}")
+    print(f"Unmatched: {len(unmatched_products)}")
     print("="*70)
-    for img in sorted(image_files):
-        print(f"  - {img}")
\ No newline at end of file
+
+    # Show unmatched products for manual review
+    if unmatched_products:
+        print("\nProducts still needing manual review:")
+        for p in unmatched_products:
+            print(f" - {p}")
+            # Show debug info for unmatched
+            print(f"   Debug matches:")
+            matcher.find_best_image(p, debug=True)
+            print()
+    else:
+        print("\n🎉 All products matched successfully!")
+
+    # Show available images that might be good candidates
+    if unmatched_products:
+        print("\n" + "="*70)
+        print("Available image files for reference:")
+        print("="*70)
+        for img in matcher.images:
+            print(f"  - {img}")
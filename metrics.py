@@ -0,0 +1,280 @@
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, before_render_template, g, request, template_rendered
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds of the SQL-statements-per-request histogram buckets
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+# SQL statements and time spent in SQLite on the current thread, reset per request
+_sql = threading.local()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense, one series per label values."""
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.labelnames = labelnames
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+            for labelvalues, (counts, total, count) in series:
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _labels(self.labelnames, labelvalues, [('le', _number(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _labels(self.labelnames, labelvalues)
+                lines.append(f"{self.name}_sum{labels} {_number(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per label values."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labelvalues):
+        with self._lock:
+            self._series[labelvalues] = self._series.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._series.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}")
+        return lines
+
+
+class Callback:
+    """A counter or gauge read from the application when /metrics is scraped."""
+
+    def __init__(self, name, help_text, kind, read):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.read = read
+
+    def render(self):
+        value = self.read()
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {_number(value)}"]
+
+
+# SQL INSTRUMENTATION
+
+def _add_sql_time(started):
+    _sql.seconds = getattr(_sql, 'seconds', 0.0) + time.perf_counter() - started
+
+
+def _count_statement(statement):
+    # FTS5 reports its internal queries (one per bm25-scored row) as "-- " comments
+    if statement.startswith('-- '):
+        return
+    _sql.queries = getattr(_sql, 'queries', 0) + 1
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor adding the time spent stepping its statement to the thread's SQL time."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _add_sql_time(started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _add_sql_time(started)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            _add_sql_time(started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _add_sql_time(started)
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            _add_sql_time(started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    sqlite3 connection factory: a trace hook counts every statement SQLite
+    runs and queries go through TimedCursor. Pass it as factory= to
+    sqlite3.connect (db.connect_readonly does for ReadPool).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(_count_statement)
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+def sql_usage():
+    """(statements, seconds) spent in SQLite on this thread since the last reset."""
+    return getattr(_sql, 'queries', 0), getattr(_sql, 'seconds', 0.0)
+
+
+def reset_sql_usage():
+    _sql.queries = 0
+    _sql.seconds = 0.0
+
+
+# FLASK INTEGRATION
+
+class Metrics:
+    """
+    Request, SQL and template timing for a Flask app, exposed in Prometheus
+    text format on /metrics and, when server_timing is on, as a
+    Server-Timing header on every response.
+    """
+
+    def __init__(self, prefix='beiradar'):
+        self.prefix = prefix
+        self.request_latency = Histogram(
+            f'{prefix}_request_duration_seconds', "Time from request start to response, by endpoint.",
+            LATENCY_BUCKETS, ('endpoint', 'method', 'status'))
+        self.sql_queries = Histogram(
+            f'{prefix}_request_sql_statements', "SQL statements run per request, by endpoint.",
+            QUERY_COUNT_BUCKETS, ('endpoint',))
+        self.sql_latency = Histogram(
+            f'{prefix}_request_sql_seconds', "Time spent in SQLite per request, by endpoint.",
+            LATENCY_BUCKETS, ('endpoint',))
+        self.template_latency = Histogram(
+            f'{prefix}_template_render_seconds', "Template render time, by template.",
+            LATENCY_BUCKETS, ('template',))
+        self.sql_statements = Counter(f'{prefix}_sql_statements_total', "SQL statements run while serving requests.")
+        self.metrics = [self.request_latency, self.sql_queries, self.sql_latency, self.template_latency,
+                        self.sql_statements]
+        self.server_timing = False
+
+    def counter(self, name, help_text, read):
+        """Export read() as a counter, e.g. a cache's hit count."""
+        self.metrics.append(Callback(f'{self.prefix}_{name}', help_text, 'counter', read))
+
+    def gauge(self, name, help_text, read):
+        """Export read() as a gauge; returning None skips it."""
+        self.metrics.append(Callback(f'{self.prefix}_{name}', help_text, 'gauge', read))
+
+    def hit_ratio(self, name, help_text, source):
+        """Export source.hits and source.misses as counters plus their ratio as a gauge."""
+        self.counter(f'{name}_hits_total', f"{help_text} hits.", lambda: source.hits)
+        self.counter(f'{name}_misses_total', f"{help_text} misses.", lambda: source.misses)
+        self.gauge(f'{name}_hit_ratio', f"{help_text} hit ratio since start.",
+                   lambda: source.hits / (source.hits + source.misses) if source.hits + source.misses else None)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def init_app(self, app, server_timing=False):
+        self.server_timing = server_timing
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.add_url_rule('/metrics', 'metrics', self._metrics_view)
+
+    def _metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_templates = []
+        g.metrics_render_seconds = 0.0
+        reset_sql_usage()
+
+    def _after_request(self, response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        queries, sql_seconds = sql_usage()
+
+        self.request_latency.observe(elapsed, endpoint, request.method, str(response.status_code))
+        self.sql_queries.observe(queries, endpoint)
+        self.sql_latency.observe(sql_seconds, endpoint)
+        self.sql_statements.inc(queries)
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = ', '.join([
+                f'app;dur={elapsed * 1000:.2f}',
+                f'sql;dur={sql_seconds * 1000:.2f};desc="{queries} statements"',
+                f'tpl;dur={g.metrics_render_seconds * 1000:.2f}',
+            ])
+        return response
+
+    def _before_render(self, sender, template, context, **extra):
+        if 'metrics_templates' in g:
+            g.metrics_templates.append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        if not g.get('metrics_templates'):
+            return
+        elapsed = time.perf_counter() - g.metrics_templates.pop()
+        g.metrics_render_seconds += elapsed
+        self.template_latency.observe(elapsed, template.name or 'string')
@@ -0,0 +1,144 @@
+import argparse
+import time
+from collections import namedtuple
+
+from db import connect_writer
+from schema import DB_PATH, STORES, ensure_price_history, query_by_keys, to_price
+
+DAY = 24 * 3600
+
+# One appended price_history point; previous_cents is the series' price before it (None if unlisted)
+PriceChange = namedtuple('PriceChange', ['product_key', 'store', 'observed_at', 'current_cents', 'original_cents',
+                                         'previous_cents'])
+
+
+def to_cents(value):
+    price = to_price(value)
+    return int(round(price * 100)) if price is not None and price > 0 else None
+
+
+def from_cents(cents):
+    return None if cents is None else cents / 100
+
+
+# RECORDING
+
+def latest_prices(conn, product_keys=None):
+    """
+    {(product_key, store): (current_cents, original_cents)} of the newest
+    point of every series (of product_keys' series only, if given).
+    """
+    sql = "SELECT product_key, store, current_cents, original_cents FROM price_latest"
+    if product_keys is None:
+        rows = conn.execute(sql)
+    else:
+        rows = query_by_keys(conn, sql + " WHERE product_key IN ({keys})", product_keys)
+    return {(key, store): (current, original) for key, store, current, original in rows}
+
+
+def record_prices(conn, observed_at=None, product_keys=None):
+    """
+    Append the products table's prices to price_history, but only for the
+    series whose price changed since their last point. A product a store no
+    longer lists (or that left the catalog) gets a NULL point so it stops
+    counting towards lows. With product_keys only those products' series
+    are compared. Returns the appended points as PriceChanges. Doesn't commit.
+    """
+    ensure_price_history(conn)
+    observed_at = int(time.time()) if observed_at is None else int(observed_at)
+    latest = latest_prices(conn, product_keys)
+
+    columns = ', '.join(f'"{store.lower()}_current", "{store.lower()}_original"' for store in STORES)
+    sql = f"SELECT product_key, {columns} FROM products WHERE product_key IS NOT NULL"
+    if product_keys is None:
+        rows = conn.execute(sql)
+    else:
+        rows = query_by_keys(conn, sql + " AND product_key IN ({keys})", product_keys)
+    current = {}
+    for row in rows:
+        for i, store in enumerate(STORES):
+            price = to_cents(row[1 + 2 * i])
+            original = to_cents(row[2 + 2 * i]) if price is not None else None
+            current[(row[0], store)] = (price, original)
+
+    changes = []
+    for series, point in current.items():
+        previous = latest.get(series)
+        if previous is None and point[0] is None:
+            continue
+        if point != previous:
+            changes.append(PriceChange(*series, observed_at, *point, previous[0] if previous else None))
+    for series, previous in latest.items():
+        if series not in current and previous[0] is not None:
+            changes.append(PriceChange(*series, observed_at, None, None, previous[0]))
+
+    conn.executemany(
+        "INSERT OR REPLACE INTO price_history (product_key, store, observed_at, current_cents, original_cents) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [change[:5] for change in changes]
+    )
+    conn.executemany(
+        "INSERT INTO price_latest (product_key, store, observed_at, current_cents, original_cents) "
+        "VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(product_key, store) DO UPDATE SET observed_at = excluded.observed_at, "
+        "current_cents = excluded.current_cents, original_cents = excluded.original_cents "
+        "WHERE excluded.observed_at >= price_latest.observed_at",
+        [change[:5] for change in changes]
+    )
+    return changes
+
+
+# QUERIES
+
+# Every change inside the window plus the point in effect when it opened;
+# both the scan and the correlated lookup are ranges of the primary key.
+WINDOW_SQL = """
+    SELECT product_key, store, observed_at, current_cents, original_cents
+    FROM price_history AS h
+    WHERE product_key IN ({keys})
+      AND observed_at >= COALESCE((
+          SELECT MAX(observed_at) FROM price_history
+          WHERE product_key = h.product_key AND store = h.store AND observed_at <= ?
+      ), 0)
+    ORDER BY product_key, store, observed_at
+"""
+
+
+def _window(conn, product_keys, days, now):
+    now = time.time() if now is None else now
+    cutoff = int(now - days * DAY)
+    return query_by_keys(conn, WINDOW_SQL, product_keys, [cutoff])
+
+
+def price_trajectory(conn, product_key, days=30, now=None):
+    """
+    Return {store: [(observed_at, current, original), ...]} for the last
+    days days. The first point of each store is the price in effect when
+    the window opened, so it can be older than the window.
+    """
+    trajectory = {}
+    for _, store, observed_at, current, original in _window(conn, [product_key], days, now):
+        trajectory.setdefault(store, []).append((observed_at, from_cents(current), from_cents(original)))
+    return trajectory
+
+
+def lowest_prices(conn, product_keys, days=30, now=None):
+    """Return {product_key: (lowest price, store)} over the last days days, for products with any price."""
+    lowest = {}
+    for key, store, _, current, _ in _window(conn, product_keys, days, now):
+        if current is not None and (key not in lowest or current < lowest[key][0]):
+            lowest[key] = (current, store)
+    return {key: (from_cents(cents), store) for key, (cents, store) in lowest.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Append the current catalog prices to the price history")
+    parser.add_argument('--at', type=int, help="observation time as a unix timestamp (default: now)")
+    args = parser.parse_args()
+
+    conn = connect_writer(DB_PATH)
+    conn.execute("BEGIN")
+    appended = record_prices(conn, args.at)
+    conn.commit()
+    conn.close()
+    print(f"Recorded {len(appended)} price changes.")
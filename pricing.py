@@ -0,0 +1,107 @@
+import numpy as np
+
+from schema import STORES
+
+STORE_KEYS = [store.lower() for store in STORES]
+
+
+class PriceTable:
+    """
+    Columnar store prices for a batch of products: one row per product,
+    one column per store (STORES order), NaN where a price is missing.
+    Best price, best store, per-store discount and on_sale are computed for
+    the whole batch at once.
+    """
+
+    # Everything rows() reads; precomputed() takes them back without recomputing
+    ARRAYS = ('current', 'original', 'best_price', 'best_store_idx', 'discount', 'on_sale')
+
+    def __init__(self, current, original):
+        self.current = current
+        self.original = original
+        self._compute()
+
+    @classmethod
+    def from_products(cls, products):
+        """Build the table from products rows (dicts from the products table)."""
+        return cls.from_columns(lambda name: [p.get(name) for p in products])
+
+    @classmethod
+    def from_columns(cls, column):
+        """
+        Build the table from column(name), which returns one products column
+        as a list. Prices are already numbers (schema.PRODUCT_COLUMNS), None if missing.
+        """
+        def prices(suffix):
+            # One row per store, transposed to one row per product
+            values = [column(f'{store}_{suffix}') for store in STORE_KEYS]
+            return np.array([[np.nan if v is None else v for v in col] for col in values], dtype=float).T.copy()
+
+        return cls(prices('current'), prices('original'))
+
+    @classmethod
+    def precomputed(cls, arrays):
+        """Wrap the ARRAYS of an already computed table (e.g. mapped from a snapshot file)."""
+        table = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(table, name, arrays[name])
+        return table
+
+    def _compute(self):
+        current = np.where(self.current > 0, self.current, np.nan)
+        missing = np.isnan(current)
+        has_price = ~missing.all(axis=1)
+
+        # Lowest valid price; ties go to the first store, like min() did
+        lowest = np.where(missing, np.inf, current)
+        best_idx = lowest.argmin(axis=1)
+        best_price = lowest[np.arange(len(current)), best_idx]
+        highest = np.where(missing, -np.inf, current).max(axis=1)
+
+        self.best_price = np.where(has_price, best_price, np.nan)
+        # No best store when every store charges the same price
+        self.best_store_idx = np.where(has_price & (highest > best_price), best_idx, -1)
+
+        on_discount = ~missing & (self.original > current)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            discount = np.round((self.original - current) * 100 / self.original, 2)
+        self.discount = np.where(on_discount, discount, 0.0)
+        self.on_sale = (self.discount > 0).any(axis=1)
+
+    def rows(self, indices=None):
+        """
+        Yield (best_price, best_store, stores, on_sale) per product, where stores maps
+        store name -> {'current', 'original', 'discount'}. Values are plain
+        Python floats or None so templates never see NumPy types.
+        """
+        if indices is None:
+            indices = np.arange(len(self.current))
+        indices = np.asarray(indices, dtype=np.intp)
+
+        def as_list(values):
+            return [[None if v != v else v for v in row] for row in values[indices].tolist()]
+
+        current = as_list(np.where(self.current > 0, self.current, np.nan))
+        original = as_list(self.original)
+        discount = self.discount[indices].tolist()
+        best_price = self.best_price[indices].tolist()
+        best_store_idx = self.best_store_idx[indices].tolist()
+        on_sale = self.on_sale[indices].tolist()
+
+        for i in range(len(indices)):
+            stores = {
+                store: {
+                    'current': current[i][j],
+                    'original': original[i][j],
+                    'discount': discount[i][j],
+                }
+                for j, store in enumerate(STORES)
+            }
+            best = best_price[i]
+            store_idx = best_store_idx[i]
+            yield (
+                None if best != best else best,
+                STORES[store_idx] if store_idx >= 0 else None,
+                stores,
+                on_sale[i],
+            )
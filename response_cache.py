@@ -0,0 +1,109 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import make_response, request
+
+MAX_ENTRIES = 512
+MAX_BYTES = 32 * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    Size-bounded LRU cache of rendered pages.
+    Entries are keyed by (catalog version, endpoint, view args, normalized
+    query args, vary key), so a re-seed makes every old entry unreachable
+    and it simply ages out.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (body, mimetype)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def cached(self, catalog, vary=None):
+        """
+        Decorator for views that depend only on their arguments, query args
+        and catalog contents. Responses get a strong ETag and Last-Modified
+        derived from the catalog version, and matching conditional requests
+        get a 304 without rendering anything. vary() returns any extra
+        per-visitor key (e.g. the cart badge count).
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                snap = catalog.snapshot()
+                query_args = tuple(sorted(
+                    (k, v.strip()) for k, values in request.args.lists() for v in values if v.strip()
+                ))
+                key = (
+                    snap.version,
+                    request.endpoint,
+                    tuple(sorted(kwargs.items())),
+                    query_args,
+                    vary() if vary else None,
+                )
+                etag = hashlib.sha1(repr(key).encode()).hexdigest()
+
+                if request.if_none_match.contains(etag):
+                    response = make_response('', 304)
+                else:
+                    entry = self.get(key)
+                    if entry is None:
+                        response = make_response(view(*args, **kwargs))
+                        # Streamed pages go out as they render and aren't cached
+                        if response.status_code != 200 or response.is_streamed:
+                            return response
+                        self.put(key, response.get_data(), response.mimetype)
+                    else:
+                        body, mimetype = entry
+                        response = make_response(body)
+                        response.mimetype = mimetype
+
+                response.set_etag(etag)
+                response.last_modified = snap.last_modified
+                # Let browsers and proxies keep the page but revalidate it every time
+                response.cache_control.no_cache = True
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
@@ -0,0 +1,767 @@
+import re
+import sqlite3
+from itertools import islice
+
+from db import connect_writer
+
+DB_PATH = 'beiradar.db'
+
+STORES = ['Carrefour', 'Naivas', 'Quickmart']
+
+# Word characters as FTS5's unicode61 tokenizer sees them (underscore is a separator)
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+# PRODUCT KEYS AND INGEST BOOKKEEPING
+
+def product_key(category, product):
+    """Stable identity of a product across re-seeds: category plus normalized name."""
+    return f"{(category or '').strip().lower()}|{' '.join(TOKEN_RE.findall((product or '').lower()))}"
+
+
+def ensure_product_key(conn):
+    """Add (and backfill) the unique product_key column used for upserts."""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+    if 'product_key' not in existing:
+        conn.execute("ALTER TABLE products ADD COLUMN product_key TEXT")
+
+    rows = conn.execute("SELECT rowid, category, product FROM products WHERE product_key IS NULL").fetchall()
+    conn.executemany(
+        "UPDATE products SET product_key = ? WHERE rowid = ?",
+        [(product_key(category, product), rowid) for rowid, category, product in rows]
+    )
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_key ON products(product_key)")
+
+
+# TYPED PRODUCTS TABLE
+
+# The products table as ingest writes it. Prices are REAL, NULL where a store
+# has no price; discounts are fractions (0.1 = 10%); unit_qty is the pack
+# size in unit_kind (g, ml or pcs), parsed from the weight, and the
+# *_unit_price columns are prices per kg, litre or piece (UNIT_PRICE_UNITS).
+PRODUCT_COLUMNS = [
+    ('product', 'TEXT'),
+    ('weight', 'TEXT'),
+    ('unit_qty', 'REAL'),
+    ('unit_kind', 'TEXT'),
+    *[(f'{store.lower()}_{field}', 'REAL') for store in STORES for field in ('current', 'original')],
+    *[(f'{store.lower()}_discount_%', 'REAL') for store in STORES],
+    ('cheapest_price', 'REAL'),
+    ('cheapest_store', 'TEXT'),
+    ('category', 'TEXT'),
+    ('image_url', 'TEXT'),
+    ('is_discounted_anywhere', 'INTEGER'),
+    ('best_price', 'REAL'),
+    ('best_store', 'TEXT'),
+    ('max_discount_pct', 'REAL'),
+    ('product_key', 'TEXT'),
+    *[(f'{store.lower()}_unit_price', 'REAL') for store in STORES],
+    ('best_unit_price', 'REAL'),
+]
+PRODUCT_COLUMN_NAMES = [name for name, _ in PRODUCT_COLUMNS]
+PRODUCT_COLUMN_SQL = ', '.join(f'"{name}"' for name in PRODUCT_COLUMN_NAMES)
+_NUMERIC_COLUMNS = {name for name, col_type in PRODUCT_COLUMNS if col_type in ('REAL', 'INTEGER')}
+
+# Headers some sheets use for a products column ("Disc %", "Weight / Count")
+COLUMN_ALIASES = {
+    **{f'{store.lower()}_disc_%': f'{store.lower()}_discount_%' for store in STORES},
+    'weight_/_count': 'weight',
+}
+_ALIASES_OF = {}
+for _alias, _target in COLUMN_ALIASES.items():
+    _ALIASES_OF.setdefault(_target, []).append(_alias)
+
+
+def unit_size(weight, product=None):
+    """
+    (unit_qty, unit_kind) of a pack size such as '3.5Kg' or '1 pc', trying
+    the size in the product name when weight has none; (None, None) if neither does.
+    """
+    # scrape_parser imports this module, so its parsers are imported late
+    from scrape_parser import parse_weight, quantity
+
+    size = quantity(parse_weight(weight or '')) or quantity(parse_weight(product or '') or '')
+    return size or (None, None)
+
+
+def typed_product(row):
+    """
+    Normalize one raw products row (a sheet record or a row of the old
+    untyped table) into a dict of PRODUCT_COLUMNS: '–' and other
+    placeholders become None, numbers become floats, alias columns are
+    folded into their canonical one and the pack size is parsed.
+    """
+    values = {}
+    for name in PRODUCT_COLUMN_NAMES:
+        value = row.get(name)
+        if value is None or value == '' or value != value:
+            value = next((row[alias] for alias in _ALIASES_OF.get(name, ()) if row.get(alias) not in (None, '')), None)
+        if name in _NUMERIC_COLUMNS:
+            value = to_price(value)
+        elif isinstance(value, str):
+            value = value.strip() or None
+        values[name] = value
+
+    if values['is_discounted_anywhere'] is not None:
+        values['is_discounted_anywhere'] = int(values['is_discounted_anywhere'])
+    values['unit_qty'], values['unit_kind'] = unit_size(values['weight'], values['product'])
+    values['image_url'] = values['image_url'] or ''
+    return values
+
+
+def create_products_table(conn, name='products'):
+    column_defs = ', '.join(f'"{column}" {col_type}' for column, col_type in PRODUCT_COLUMNS)
+    conn.execute(f'CREATE TABLE "{name}" ({column_defs})')
+
+
+def ensure_typed_products(conn):
+    """
+    Rebuild an older products table (TEXT prices, duplicate sheet columns)
+    as PRODUCT_COLUMNS, keeping every rowid so deals, carts and the search
+    index still point at the same products. Returns True if it rebuilt.
+    """
+    existing = [(row[1], row[2]) for row in conn.execute("PRAGMA table_info(products)")]
+    if existing == PRODUCT_COLUMNS:
+        return False
+
+    cursor = conn.execute("SELECT rowid AS rowid_, * FROM products")
+    names = [d[0] for d in cursor.description]
+    rows = [dict(zip(names, values)) for values in cursor.fetchall()]
+
+    conn.execute("DROP TABLE IF EXISTS products_typed")
+    create_products_table(conn, 'products_typed')
+    conn.executemany(
+        f"INSERT INTO products_typed (rowid, {PRODUCT_COLUMN_SQL}) "
+        f"VALUES ({', '.join('?' * (len(PRODUCT_COLUMNS) + 1))})",
+        [[row['rowid_']] + list(typed_product(row).values()) for row in rows]
+    )
+    conn.execute("DROP TABLE products")
+    conn.execute("ALTER TABLE products_typed RENAME TO products")
+
+    # Indexes and triggers went with the old table
+    ensure_product_key(conn)
+    rebuild_search_index(conn)
+    refresh_price_columns(conn)
+    ensure_catalog_generation(conn)
+    return True
+
+
+def ensure_ingest_files(conn):
+    """Create the table remembering the hash of every ingested source file."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_files (
+            path TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            ingested_at TEXT NOT NULL
+        )
+    """)
+
+
+def ensure_scraped_prices(conn):
+    """Create the table holding per-store prices parsed from raw scrape dumps."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS scraped_prices (
+            id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            store TEXT NOT NULL,
+            category TEXT NOT NULL,
+            product TEXT NOT NULL,
+            weight TEXT,
+            current_price REAL NOT NULL,
+            original_price REAL,
+            scraped_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scraped_prices_source ON scraped_prices(source)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scraped_prices_store ON scraped_prices(store, category)")
+
+
+def ensure_scraped_matches(conn):
+    """
+    Create the table of cross-store matches between scraped_prices rows:
+    one row per product, a scraped_prices id per store (NULL where that
+    store has no match) and the matcher's confidence.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS scraped_matches (
+            id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            product TEXT NOT NULL,
+            weight TEXT,
+            carrefour_id INTEGER,
+            naivas_id INTEGER,
+            quickmart_id INTEGER,
+            confidence REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scraped_matches_category ON scraped_matches(category)")
+
+
+def ensure_price_history(conn):
+    """
+    Create the append-only price history: one row per price change of a
+    (product_key, store) series, prices in integer cents and a NULL current
+    price when the store stopped listing the product. The clustered primary
+    key covers every history query, so they never touch a separate table.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS price_history (
+            product_key TEXT NOT NULL,
+            store TEXT NOT NULL,
+            observed_at INTEGER NOT NULL,
+            current_cents INTEGER,
+            original_cents INTEGER,
+            PRIMARY KEY (product_key, store, observed_at)
+        ) WITHOUT ROWID
+    """)
+    # The newest point of every series, kept by price_history.record_prices so
+    # an ingest compares against one row per series, not the whole history
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS price_latest (
+            product_key TEXT NOT NULL,
+            store TEXT NOT NULL,
+            observed_at INTEGER NOT NULL,
+            current_cents INTEGER,
+            original_cents INTEGER,
+            PRIMARY KEY (product_key, store)
+        ) WITHOUT ROWID
+    """)
+    if (conn.execute("SELECT 1 FROM price_latest LIMIT 1").fetchone() is None
+            and conn.execute("SELECT 1 FROM price_history LIMIT 1").fetchone() is not None):
+        # History recorded before price_latest existed; SQLite takes the bare
+        # columns of a MAX() aggregate from the row holding the max
+        conn.execute("""
+            INSERT INTO price_latest (product_key, store, observed_at, current_cents, original_cents)
+            SELECT product_key, store, MAX(observed_at), current_cents, original_cents
+            FROM price_history GROUP BY product_key, store
+        """)
+
+
+# FULL-TEXT SEARCH INDEX
+
+SEARCH_INDEX_SQL = [
+    "DROP TABLE IF EXISTS products_fts",
+    """
+    CREATE VIRTUAL TABLE products_fts USING fts5(
+        product, weight, category,
+        content='products',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+
+    "DROP TRIGGER IF EXISTS products_fts_ai",
+    "DROP TRIGGER IF EXISTS products_fts_ad",
+    "DROP TRIGGER IF EXISTS products_fts_au",
+    """
+    CREATE TRIGGER products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, product, weight, category)
+        VALUES (new.rowid, new.product, new.weight, new.category);
+    END
+    """,
+    """
+    CREATE TRIGGER products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, product, weight, category)
+        VALUES ('delete', old.rowid, old.product, old.weight, old.category);
+    END
+    """,
+    """
+    CREATE TRIGGER products_fts_au AFTER UPDATE OF product, weight, category ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, product, weight, category)
+        VALUES ('delete', old.rowid, old.product, old.weight, old.category);
+        INSERT INTO products_fts(rowid, product, weight, category)
+        VALUES (new.rowid, new.product, new.weight, new.category);
+    END
+    """,
+]
+
+
+# Keys per IN (...) batch, well under SQLite's bound parameter limit
+KEY_BATCH = 500
+
+
+def run_statements(conn, statements):
+    """
+    Execute statements one by one. Unlike executescript this never commits,
+    so callers can group a whole refresh into a single transaction.
+    """
+    for sql in statements:
+        conn.execute(sql)
+
+
+def query_by_keys(conn, sql, keys, params=()):
+    """
+    Run sql once per KEY_BATCH of keys (duplicates dropped), with its {keys}
+    placeholder standing for that batch's bound keys and params bound after
+    them, and yield every row.
+    """
+    keys = iter(dict.fromkeys(keys))
+    while True:
+        batch = list(islice(keys, KEY_BATCH))
+        if not batch:
+            break
+        yield from conn.execute(sql.format(keys=', '.join('?' * len(batch))), batch + list(params))
+
+
+def rebuild_search_index(conn):
+    """
+    (Re)build the products_fts table over product, weight and category.
+    It is an external-content FTS5 table, so only the index is stored and
+    its triggers keep it in sync with later writes to products.
+    """
+    run_statements(conn, SEARCH_INDEX_SQL)
+
+
+def fts_query(text):
+    """
+    Turn free text into an FTS5 MATCH expression where every word is a
+    prefix match, e.g. 'brook milk' -> '"brook"* AND "milk"*'. Words joined
+    by '|' are alternatives, e.g. 'yogurt|yoghurt' -> '("yogurt"* OR "yoghurt"*)'.
+    Returns None when the text has no searchable words.
+    """
+    terms = []
+    for chunk in text.lower().split():
+        alternatives = [' AND '.join(f'"{tok}"*' for tok in TOKEN_RE.findall(alt)) for alt in chunk.split('|')]
+        alternatives = [alt for alt in alternatives if alt]
+        if len(alternatives) > 1:
+            terms.append(f"({' OR '.join(alternatives)})")
+        elif alternatives:
+            terms.append(alternatives[0])
+    # FTS5 needs an explicit AND next to a parenthesized group
+    return ' AND '.join(terms) or None
+
+
+def to_price(value):
+    """Parse a raw price ('679', 605.0, '–', NaN, None) into a float or None. Ingest only."""
+    if value is None or value == '' or value == '–':
+        return None
+    try:
+        price = float(value)
+    except (ValueError, TypeError):
+        return None
+    return None if price != price else price
+
+
+# PRECOMPUTED PRICE COLUMNS
+
+# unit_kind -> (pack units per priced unit, priced unit): unit prices are per kg, L or piece
+UNIT_PRICE_UNITS = {'g': (1000, 'kg'), 'ml': (1000, 'L'), 'pcs': (1, 'pc')}
+
+# Listing orders for product_query (ties broken by rowid). Each expression
+# has an index of its own and one after category, so a sorted page is an
+# index range scan rather than a sort. Missing prices sort last.
+SORTS = {
+    'price': "ifnull(best_price, 1e308)",
+    'unit_price': "ifnull(best_unit_price, 1e308)",
+    'discount': "-ifnull(max_discount_pct, 0.0)",
+}
+
+
+def best_price_columns(row):
+    """
+    Compute (best_price, best_store, max_discount_pct) for one products row.
+    best_store is None when every store charges the same price, as in
+    pricing.PriceTable.
+    """
+    prices = []
+    max_discount = 0.0
+    for store in STORES:
+        store_lower = store.lower()
+        current = to_price(row.get(f'{store_lower}_current'))
+        original = to_price(row.get(f'{store_lower}_original'))
+        if current:
+            prices.append((store, current))
+            if original and original > current:
+                max_discount = max(max_discount, (original - current) * 100 / original)
+
+    if not prices:
+        return None, None, max_discount
+
+    best_store, best_price = min(prices, key=lambda x: x[1])
+    if len({price for _, price in prices}) == 1:
+        best_store = None
+    return best_price, best_store, max_discount
+
+
+def unit_price(price, unit_qty, unit_kind):
+    """Price per kg, litre or piece of a pack of unit_qty unit_kind, or None."""
+    if not price or not unit_qty or unit_kind not in UNIT_PRICE_UNITS:
+        return None
+    return round(price * UNIT_PRICE_UNITS[unit_kind][0] / unit_qty, 2)
+
+
+def unit_price_columns(row, best_price):
+    """Each store's unit price, then the best price's, for one products row."""
+    per_store = tuple(
+        unit_price(to_price(row.get(f'{store.lower()}_current')), row.get('unit_qty'), row.get('unit_kind'))
+        for store in STORES
+    )
+    return per_store + (unit_price(best_price, row.get('unit_qty'), row.get('unit_kind')),)
+
+
+UNIT_PRICE_COLUMNS = [f'{store.lower()}_unit_price' for store in STORES] + ['best_unit_price']
+
+PRICE_INDEX_SQL = [
+    # The default order within a category: the index's entries end in rowid
+    "CREATE INDEX IF NOT EXISTS idx_products_category ON products(category COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS idx_products_category_price ON products(category COLLATE NOCASE, best_price)",
+    "CREATE INDEX IF NOT EXISTS idx_products_best_price ON products(best_price)",
+    "CREATE INDEX IF NOT EXISTS idx_products_max_discount ON products(max_discount_pct)",
+    *[f"CREATE INDEX IF NOT EXISTS idx_products_sort_{sort} ON products({expr})" for sort, expr in SORTS.items()],
+    *[
+        f"CREATE INDEX IF NOT EXISTS idx_products_category_sort_{sort} ON products(category COLLATE NOCASE, {expr})"
+        for sort, expr in SORTS.items()
+    ],
+]
+
+
+def refresh_price_columns(conn, product_keys=None):
+    """
+    Fill the indexed best_price, best_store, max_discount_pct and unit price
+    columns, and create the indexes behind SORTS. With product_keys only
+    those products' rows are recomputed.
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+    added = [('best_price', 'REAL'), ('best_store', 'TEXT'), ('max_discount_pct', 'REAL')]
+    for column, col_type in added + [(column, 'REAL') for column in UNIT_PRICE_COLUMNS]:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE products ADD COLUMN {column} {col_type}")
+
+    names = ['rowid'] + [row[1] for row in conn.execute("PRAGMA table_info(products)")]
+    if product_keys is None:
+        rows = conn.execute("SELECT rowid, * FROM products")
+    else:
+        rows = query_by_keys(conn, "SELECT rowid, * FROM products WHERE product_key IN ({keys})", product_keys)
+    updates = []
+    for values in rows:
+        row = dict(zip(names, values))
+        best = best_price_columns(row)
+        updates.append(best + unit_price_columns(row, best[0]) + (row['rowid'],))
+
+    conn.executemany(
+        "UPDATE products SET best_price = ?, best_store = ?, max_discount_pct = ?, "
+        f"{', '.join(f'{column} = ?' for column in UNIT_PRICE_COLUMNS)} WHERE rowid = ?",
+        updates
+    )
+    run_statements(conn, PRICE_INDEX_SQL)
+
+
+# CATALOG GENERATION
+
+# Columns ingest recomputes from the others (refresh_price_columns) on every run
+DERIVED_PRODUCT_COLUMNS = {'best_price', 'best_store', 'max_discount_pct', *UNIT_PRICE_COLUMNS}
+_SOURCE_COLUMN_SQL = ', '.join(f'"{name}"' for name in PRODUCT_COLUMN_NAMES if name not in DERIVED_PRODUCT_COLUMNS)
+
+# Any insert, delete or change of a source column bumps the generation, so a
+# snapshot file (which records the generation it was written at) can be told
+# apart from one the database has moved on from, whoever wrote the change.
+# Refreshing the derived columns doesn't fire them.
+GENERATION_TRIGGER_SQL = [
+    "DROP TRIGGER IF EXISTS products_generation_ai",
+    "DROP TRIGGER IF EXISTS products_generation_ad",
+    "DROP TRIGGER IF EXISTS products_generation_au",
+    """
+    CREATE TRIGGER products_generation_ai AFTER INSERT ON products BEGIN
+        UPDATE catalog_generation SET generation = generation + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER products_generation_ad AFTER DELETE ON products BEGIN
+        UPDATE catalog_generation SET generation = generation + 1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER products_generation_au AFTER UPDATE OF {_SOURCE_COLUMN_SQL} ON products BEGIN
+        UPDATE catalog_generation SET generation = generation + 1;
+    END
+    """,
+]
+
+
+def ensure_catalog_generation(conn, bump=False):
+    """
+    Create the products generation counter and its triggers. It is bumped
+    (and the triggers recreated) when bump is set or the triggers are
+    missing: a products table that was just swapped or rebuilt lost them
+    and may hold anything. Otherwise it is left alone, so an ingest with
+    nothing to change doesn't make the web app reload.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO catalog_generation (id, generation) VALUES (1, 0)")
+    triggers = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'products' "
+        "AND name LIKE 'products_generation_%'"
+    ).fetchone()[0]
+    if bump or triggers < 3:
+        conn.execute("UPDATE catalog_generation SET generation = generation + 1")
+        run_statements(conn, GENERATION_TRIGGER_SQL)
+
+
+def catalog_generation(conn):
+    """The products generation, or None in a database from before it was kept."""
+    try:
+        row = conn.execute("SELECT generation FROM catalog_generation").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+# MATERIALIZED DEALS
+
+def deal_for(row):
+    """
+    Return (store, old_price, new_price, deal_percentage) for the cross-store
+    spread of one products row, or None when it is not a deal.
+    """
+    prices = {}
+    for store in STORES:
+        price = row.get(f'{store.lower()}_current')
+        if price and price > 0:
+            prices[store] = price
+
+    if len(prices) < 2:
+        return None
+
+    best_store = min(prices, key=prices.get)
+    best_price = prices[best_store]
+    max_price = max(prices.values())
+    if max_price <= best_price:
+        return None
+
+    discount_pct = round((max_price - best_price) * 100 / max_price, 2)
+    if discount_pct <= 0:
+        return None
+    return best_store, max_price, best_price, discount_pct
+
+
+def _deal_rows(names, rows):
+    for values in rows:
+        row = dict(zip(names, values))
+        deal = deal_for(row)
+        if deal:
+            yield (row['rowid'],) + deal + (row['category'],)
+
+
+def refresh_deals(conn, product_keys=None):
+    """
+    Rebuild the deals table, stored in deal_percentage order. With
+    product_keys only those products' deals are replaced (and the deals of
+    products no longer in the catalog dropped).
+    """
+    names = ['rowid'] + [row[1] for row in conn.execute("PRAGMA table_info(products)")]
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'deals'").fetchone()
+    if product_keys is not None and exists:
+        rows = list(query_by_keys(conn, "SELECT rowid, * FROM products WHERE product_key IN ({keys})", product_keys))
+        conn.execute("DELETE FROM deals WHERE product_id NOT IN (SELECT rowid FROM products)")
+        conn.executemany("DELETE FROM deals WHERE product_id = ?", [(row[0],) for row in rows])
+        conn.executemany("INSERT INTO deals VALUES (?, ?, ?, ?, ?, ?)", _deal_rows(names, rows))
+        return
+
+    deals = list(_deal_rows(names, conn.execute("SELECT rowid, * FROM products ORDER BY rowid")))
+    deals.sort(key=lambda d: (-d[4], d[0]))
+
+    run_statements(conn, [
+        "DROP TABLE IF EXISTS deals",
+        """
+        CREATE TABLE deals (
+            product_id INTEGER PRIMARY KEY,
+            store TEXT,
+            old_price REAL,
+            new_price REAL,
+            deal_percentage REAL,
+            category TEXT
+        )
+        """,
+    ])
+    conn.executemany("INSERT INTO deals VALUES (?, ?, ?, ?, ?, ?)", deals)
+    run_statements(conn, [
+        "CREATE INDEX idx_deals_pct ON deals(deal_percentage DESC, product_id)",
+        "CREATE INDEX idx_deals_store ON deals(store, deal_percentage DESC, product_id)",
+        "CREATE INDEX idx_deals_category ON deals(category COLLATE NOCASE, deal_percentage DESC, product_id)",
+    ])
+
+
+# QUERIES
+
+def product_query(search_query=None, category=None, min_price=None, max_price=None, min_discount=None,
+                  sort=None):
+    """
+    Build the FROM/WHERE part of a products query for the given filters.
+    Returns (sql, params, sort_key), where sort_key lists the expressions the
+    results are ordered by (the SORTS expression when sort names one, else
+    bm25 for searches; rowid last), or None when the search text has no
+    searchable words.
+    """
+    conditions = []
+    params = []
+
+    if search_query:
+        match = fts_query(search_query)
+        if match is None:
+            return None
+        sql = "FROM products_fts JOIN products p ON p.rowid = products_fts.rowid"
+        conditions.append("products_fts MATCH ?")
+        params.append(match)
+        # Product name hits weigh more than category hits, weight matters least
+        sort_key = ["bm25(products_fts, 10.0, 1.0, 5.0)", "p.rowid"]
+    else:
+        sql = "FROM products p"
+        sort_key = ["p.rowid"]
+    if sort in SORTS:
+        sort_key = [SORTS[sort], "p.rowid"]
+
+    if category:
+        conditions.append("p.category = ? COLLATE NOCASE")
+        params.append(category)
+
+    # The price range is half-open, min_price <= best_price < max_price, like
+    # facets.PRICE_BUCKETS; products without any price are outside every range
+    if min_price is not None:
+        conditions.append("p.best_price >= ?")
+        params.append(min_price)
+    if max_price is not None:
+        conditions.append("p.best_price < ?")
+        params.append(max_price)
+
+    if min_discount is not None:
+        conditions.append("p.max_discount_pct >= ?")
+        params.append(min_discount)
+
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql, params, sort_key
+
+
+def find_product_ids(conn, search_query=None, category=None, min_price=None, max_price=None,
+                     min_discount=None, sort=None, limit=None):
+    """
+    Return product rowids matching every given filter, in sort order (see
+    SORTS); by default search results come best bm25 match first and
+    everything else in rowid order.
+    """
+    query = product_query(search_query, category, min_price, max_price, min_discount, sort)
+    if query is None:
+        return []
+    sql, params, sort_key = query
+
+    sql = f"SELECT p.rowid {sql} ORDER BY {', '.join(sort_key)}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    return [row[0] for row in conn.execute(sql, params)]
+
+
+def match_ids(conn, search_query):
+    """Rowids of every product the search text matches, unordered (no ranking or filters)."""
+    match = fts_query(search_query)
+    if match is None:
+        return []
+    return [row[0] for row in conn.execute("SELECT rowid FROM products_fts WHERE products_fts MATCH ?", (match,))]
+
+
+def find_product_page(conn, limit, after=None, offset=0, **filters):
+    """
+    Return (ids, last_key, total) for one page of find_product_ids results.
+    after is the last_key of the previous page (keyset pagination: the
+    query seeks straight past it); offset is only used without after.
+    """
+    query = product_query(**filters)
+    if query is None:
+        return [], None, 0
+    sql, params, sort_key = query
+
+    total = conn.execute(f"SELECT COUNT(*) {sql}", params).fetchone()[0]
+
+    if after is not None and len(after) == len(sort_key):
+        # The plain bound on the leading expression lets SQLite seek its
+        # index; the row-value comparison alone would scan from the start
+        keyset = f"{sort_key[0]} >= ? AND ({', '.join(sort_key)}) > ({', '.join('?' * len(after))})"
+        sql += (" AND " if " WHERE " in sql else " WHERE ") + keyset
+        params = params + [after[0]] + list(after)
+        offset = 0
+
+    columns = ', '.join(sort_key)
+    rows = conn.execute(
+        f"SELECT {columns} {sql} ORDER BY {columns} LIMIT ? OFFSET ?",
+        params + [limit, offset]
+    ).fetchall()
+
+    ids = [row[-1] for row in rows]
+    last_key = tuple(rows[-1]) if rows else None
+    return ids, last_key, total
+
+
+def encode_cursor(key):
+    """Encode a find_product_page sort key as a URL-safe cursor string."""
+    return '_'.join(repr(v) for v in key)
+
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor; returns None if it is malformed."""
+    try:
+        *scores, rowid = cursor.split('_')
+        return tuple(float(v) for v in scores) + (int(rowid),)
+    except (ValueError, AttributeError):
+        return None
+
+
+def find_deals(conn, store=None, category=None, limit=None, offset=0):
+    """
+    Return (deals, total) for one page of the deals table, biggest deal first.
+    Each deal is a dict with product_id, store, old_price, new_price and
+    deal_percentage.
+    """
+    conditions = []
+    params = []
+    if store:
+        conditions.append("store = ?")
+        params.append(store)
+    if category:
+        conditions.append("category = ? COLLATE NOCASE")
+        params.append(category)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    total = conn.execute(f"SELECT COUNT(*) FROM deals{where}", params).fetchone()[0]
+
+    sql = f"""
+        SELECT product_id, store, old_price, new_price, deal_percentage FROM deals{where}
+        ORDER BY deal_percentage DESC, product_id
+        LIMIT ? OFFSET ?
+    """
+    cursor = conn.execute(sql, params + [-1 if limit is None else limit, offset])
+    names = [d[0] for d in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()], total
+
+
+def migrate(conn):
+    """Bring an existing database up to date with the derived tables."""
+    conn.execute("BEGIN")
+    ensure_product_key(conn)
+    ensure_typed_products(conn)
+    ensure_ingest_files(conn)
+    ensure_scraped_prices(conn)
+    ensure_scraped_matches(conn)
+    ensure_price_history(conn)
+    rebuild_search_index(conn)
+    refresh_price_columns(conn)
+    refresh_deals(conn)
+    # The migration may have rewritten any column, derived ones included
+    ensure_catalog_generation(conn, bump=True)
+    conn.commit()
+
+
+if __name__ == '__main__':
+    from snapshot_file import snapshot_path, write_snapshot
+
+    conn = connect_writer(DB_PATH)
+    migrate(conn)
+    # Web workers would otherwise keep mapping the snapshot of the unmigrated table
+    write_snapshot(conn, snapshot_path(DB_PATH))
+    conn.close()
+    print("Database migrated successfully!")
@@ -0,0 +1,222 @@
+import argparse
+import os
+import re
+from collections import namedtuple
+from datetime import datetime, timezone
+from itertools import islice
+
+from db import connect_writer
+from schema import ensure_scraped_prices
+
+DB_PATH = 'beiradar.db'
+SORT_ROOT = 'Sort'
+BATCH_SIZE = 500
+
+# Dump files are named <store prefix>_<item>.txt, e.g. c_milk.txt
+STORE_PREFIXES = {'c': 'Carrefour', 'n': 'Naivas', 'q': 'Quickmart'}
+
+PriceRecord = namedtuple('PriceRecord', ['store', 'category', 'product', 'weight', 'current', 'original'])
+
+# Carrefour splits prices over two lines: "1,431" then ".00"
+_INTEGER_RE = re.compile(r'^\d{1,3}(?:,\d{3})*$|^\d+$')
+_DECIMAL_RE = re.compile(r'^\.\d+$')
+# Naivas / Quickmart: "KES 1,399" or "KES 68.00"
+_KES_PRICE_RE = re.compile(r'^KES\s*([\d,]+(?:\.\d+)?)$')
+
+# Lines that carry no product or price information
+_NOISE_RE = re.compile(
+    r'^(?:KES|ADD TO CART|Deals Kikwetu|Anniversary Deals|0\.00)$'
+    r'|^Only \d+ left$'
+    r'|^Save KES [\d,.]+$'
+    r'|^\(?[\d.]+% off\)?$'
+    r'|^[\d.]+%$'
+    r'|^no \w',
+    re.IGNORECASE
+)
+_PROMO_SUFFIX_RE = re.compile(r'(?:Deals Kikwetu|Anniversary Deals)$')
+_UNAVAILABLE_RE = re.compile(r'\s*-\s*not available$', re.IGNORECASE)
+
+_WEIGHT_RE = re.compile(
+    r"(\d+(?:\.\d+)?)\s*(kg|g|ml|ltrs?|lt|l|pcs?|pieces?|pack|pk|'?s)\b",
+    re.IGNORECASE
+)
+_WEIGHT_UNITS = {
+    'kg': 'kg', 'g': 'g', 'ml': 'ml',
+    'l': 'L', 'lt': 'L', 'ltr': 'L', 'ltrs': 'L',
+    'pc': 'pcs', 'pcs': 'pcs', 'piece': 'pcs', 'pieces': 'pcs', 'pack': 'pcs', 'pk': 'pcs', 's': 'pcs', "'s": 'pcs',
+}
+
+
+def parse_weight(name):
+    """Pull the pack size out of a product name, e.g. 'Tuzo Esl 450Ml' -> '450ml'."""
+    matches = _WEIGHT_RE.findall(name)
+    if not matches:
+        return None
+    qty, unit = matches[-1]
+    return f"{qty}{_WEIGHT_UNITS[unit.lower()]}"
+
+
+# Canonical unit and multiplier for each parse_weight unit
+_BASE_UNITS = {'kg': ('g', 1000), 'g': ('g', 1), 'L': ('ml', 1000), 'ml': ('ml', 1), 'pcs': ('pcs', 1)}
+_QUANTITY_RE = re.compile(r'^(\d+(?:\.\d+)?)(kg|g|ml|L|pcs)$')
+
+
+def quantity(weight):
+    """Turn a parse_weight() string into (amount, unit) in g, ml or pcs, e.g. '3L' -> (3000.0, 'ml')."""
+    m = _QUANTITY_RE.match(weight or '')
+    if not m:
+        return None
+    unit, factor = _BASE_UNITS[m.group(2)]
+    return float(m.group(1)) * factor, unit
+
+
+def _price(text):
+    return float(text.replace(',', ''))
+
+
+def parse_lines(lines, store, category):
+    """
+    Turn the lines of one raw dump into PriceRecords, one at a time.
+
+    A record starts at a product name line; when a shop repeats or truncates
+    the name ('Tuzo Esl...' then 'Tuzo Esl 450Ml') the last name before the
+    price wins. The first price is the current one and a second one is the
+    pre-discount original. A blank line ends a priced record, and stock
+    notes, savings and promo banners are skipped.
+    """
+    name = None
+    prices = []
+    integer_part = None
+    sealed = False
+    unavailable = False
+
+    def record():
+        if name and prices and not unavailable:
+            current = prices[0]
+            original = prices[1] if len(prices) > 1 and prices[1] > current else None
+            return PriceRecord(store, category, name, parse_weight(name), current, original)
+        return None
+
+    for raw in lines:
+        line = raw.strip()
+
+        # A split price whose ".00" never came is still a price
+        if integer_part is not None and not _DECIMAL_RE.match(line):
+            if not sealed and not unavailable:
+                prices.append(integer_part)
+            integer_part = None
+
+        if not line:
+            sealed = bool(prices)
+            continue
+        if _NOISE_RE.match(line):
+            continue
+
+        if _INTEGER_RE.match(line):
+            integer_part = _price(line)
+            continue
+        if _DECIMAL_RE.match(line):
+            if integer_part is not None and not sealed and not unavailable:
+                prices.append(integer_part + float(line))
+            integer_part = None
+            continue
+
+        m = _KES_PRICE_RE.match(line)
+        if m:
+            if not sealed and not unavailable:
+                prices.append(_price(m.group(1)))
+            continue
+
+        # Anything else is a product name
+        if prices:
+            rec = record()
+            if rec:
+                yield rec
+            name = None
+            prices = []
+        sealed = False
+
+        line = _PROMO_SUFFIX_RE.sub('', line).strip()
+        unavailable = bool(_UNAVAILABLE_RE.search(line))
+        if unavailable:
+            name = _UNAVAILABLE_RE.sub('', line)
+        elif name is None or not line.endswith('...'):
+            name = line
+
+    if integer_part is not None and not sealed and not unavailable:
+        prices.append(integer_part)
+    rec = record()
+    if rec:
+        yield rec
+
+
+def dump_info(path):
+    """Return (store, category) for a dump path like Sort/Dairy/Milk/c_milk.txt."""
+    prefix = os.path.basename(path).split('_', 1)[0].lower()
+    store = STORE_PREFIXES.get(prefix)
+    category = os.path.basename(os.path.dirname(path)).lower()
+    return store, category
+
+
+def find_dumps(root=SORT_ROOT):
+    """Yield every raw dump (Sort/<group>/<category>/<store>_<item>.txt) under root."""
+    for dirpath, _, filenames in sorted(os.walk(root)):
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if filename.endswith('.txt') and dump_info(path)[0]:
+                yield path
+
+
+def parse_dump(path):
+    """Stream PriceRecords from one dump file without reading it whole."""
+    store, category = dump_info(path)
+    with open(path, encoding='utf-8', errors='replace') as f:
+        yield from parse_lines(f, store, category)
+
+
+def load_dumps(conn, root=SORT_ROOT, batch_size=BATCH_SIZE):
+    """
+    Replace the scraped_prices rows of every dump under root, writing them in
+    batches of batch_size so memory stays flat however large the dumps are.
+    seeder_db.py --from-dumps runs this and turns the rows into products.
+    """
+    ensure_scraped_prices(conn)
+    conn.commit()
+    scraped_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    totals = {}
+
+    for path in find_dumps(root):
+        source = os.path.relpath(path, root)
+        records = parse_dump(path)
+        count = 0
+
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM scraped_prices WHERE source = ?", (source,))
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            conn.executemany(
+                "INSERT INTO scraped_prices (source, store, category, product, weight, current_price, "
+                "original_price, scraped_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(source,) + tuple(rec) + (scraped_at,) for rec in batch]
+            )
+            count += len(batch)
+        conn.commit()
+        totals[source] = count
+
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load raw store scrape dumps into beiradar.db")
+    parser.add_argument('root', nargs='?', default=SORT_ROOT, help="directory holding the category folders")
+    args = parser.parse_args()
+
+    conn = connect_writer(DB_PATH)
+    totals = load_dumps(conn, args.root)
+    conn.close()
+
+    for source, count in totals.items():
+        print(f"  {source}: {count} prices")
+    print(f"Loaded {sum(totals.values())} prices from {len(totals)} dumps.")
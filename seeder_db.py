@@ -1,10 +1,28 @@
+import argparse
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
 import pandas as pd
-import sqlite3
+
+from db import connect_writer
+from mapper import update_image_urls
+from price_history import record_prices
+from schema import (PRODUCT_COLUMN_NAMES, create_products_table, ensure_catalog_generation, ensure_ingest_files,
+                    ensure_product_key, ensure_typed_products, product_key, rebuild_search_index, refresh_deals,
+                    refresh_price_columns, typed_product)
+from scrape_parser import SORT_ROOT, load_dumps
+from snapshot_file import snapshot_path, write_snapshot
+from store_matcher import match_scraped, save_matches, scraped_products
+from watchlist import queue_alerts
+
+DB_PATH = 'beiradar.db'
 
 # Load your Excel files
 files = {
     "oil": "Sort/Oil data.xlsx",
-    "rice": "Sort/Rice Data.xlsx",
+    "rice": "Sort/Rice data.xlsx",
     "sugar": "Sort/Sugar data.xlsx",
     "milk": "Sort/Milk data.xlsx",
     "yoghurt": "Sort/Yoghurt data.xlsx",
@@ -19,32 +37,220 @@ files = {
 
 }
 
-dfs = {}
-for category, path in files.items():
+# Columns computed after loading that a re-read sheet must not overwrite
+DERIVED_COLUMNS = {'image_url'}
+
+
+def read_category(category, path):
+    """Read one category sheet into a DataFrame of typed products rows (schema.PRODUCT_COLUMNS)."""
     df = pd.read_excel(path)
     # Normalize column names
     df.columns = [c.lower().replace(' ', '_') for c in df.columns]
-    
+
     # Add category column
     df['category'] = category
-    
+
     # Optional: add extra columns
     df['image_url'] = ''
     df['is_discounted_anywhere'] = 1
-    
-    # Convert price columns to numeric
-    for col in df.columns:
-        if 'price' in col:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-    
-    dfs[category] = df
-
-# Concatenate all products
-all_products = pd.concat(dfs.values(), ignore_index=True)
-
-# Insert into SQLite database
-conn = sqlite3.connect('beiradar.db')
-all_products.to_sql('products', conn, if_exists='replace', index=False)
-conn.close()
-
-print("Database updated successfully!")
+
+    df['product_key'] = [product_key(category, name) for name in df['product']]
+
+    # Parse prices, placeholders and pack sizes once here, never at request time
+    records = df.astype(object).where(pd.notna(df), None).to_dict('records')
+    return pd.DataFrame([typed_product(r) for r in records], columns=PRODUCT_COLUMN_NAMES)
+
+
+def read_categories(sources):
+    """Read {category: path} sheets, in parallel worker processes when there are several."""
+    if len(sources) <= 1:
+        return {category: read_category(category, path) for category, path in sources.items()}
+
+    with ProcessPoolExecutor(max_workers=min(len(sources), os.cpu_count() or 1)) as pool:
+        futures = {category: pool.submit(read_category, category, path) for category, path in sources.items()}
+        return {category: future.result() for category, future in futures.items()}
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def record_hashes(conn, hashes):
+    now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    conn.executemany(
+        "INSERT INTO ingest_files (path, sha256, ingested_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(path) DO UPDATE SET sha256 = excluded.sha256, ingested_at = excluded.ingested_at",
+        [(path, sha, now) for path, sha in hashes.items()]
+    )
+
+
+def refresh_derived(conn, only_missing_images=False, product_keys=None):
+    """
+    Recompute everything derived from the products rows; with product_keys
+    (an incremental ingest's upserted and removed products) only from theirs.
+    """
+    refresh_price_columns(conn, product_keys)
+    refresh_deals(conn, product_keys)
+    update_image_urls(conn, only_missing=only_missing_images)
+    # Only this run's price changes are checked against the watchlists (their
+    # own database, committed at once: a failed ingest can repeat an alert, never lose one)
+    alerts = queue_alerts(conn, record_prices(conn, product_keys=product_keys))
+    if alerts:
+        print(f"  {alerts} price-drop alerts queued")
+
+
+# FULL REBUILD
+
+def seed_full(conn):
+    """Re-read every sheet and replace the products table."""
+    hashes = {path: file_hash(path) for path in files.values()}
+    dfs = read_categories(files)
+
+    # Concatenate all products
+    all_products = pd.concat(dfs.values(), ignore_index=True)
+
+    # The new rows go into a staging table first and are swapped in with the
+    # derived tables in one transaction, so readers (WAL mode) keep seeing the
+    # previous catalog until the commit.
+    conn.execute("DROP TABLE IF EXISTS products_staging")
+    create_products_table(conn, 'products_staging')
+    all_products.to_sql('products_staging', conn, if_exists='append', index=False)
+
+    conn.execute("BEGIN")
+    conn.execute("DROP TABLE IF EXISTS products")
+    conn.execute("ALTER TABLE products_staging RENAME TO products")
+
+    # Rebuild the full-text index, precomputed price columns and deals over the fresh table
+    ensure_product_key(conn)
+    ensure_catalog_generation(conn)
+    rebuild_search_index(conn)
+    refresh_derived(conn)
+
+    ensure_ingest_files(conn)
+    record_hashes(conn, hashes)
+    conn.commit()
+    return len(all_products)
+
+
+# INCREMENTAL INGEST
+
+def upsert_category(conn, category, df):
+    """
+    Upsert one category's rows by product_key and drop the ones that left the
+    sheet. Derived columns (image_url) of existing products are kept.
+    Returns (upserted keys, removed keys).
+    """
+    columns = list(df.columns)
+    column_list = ', '.join(f'"{c}"' for c in columns)
+    placeholders = ', '.join('?' * len(columns))
+    assignments = ', '.join(
+        f'"{c}" = excluded."{c}"' for c in columns if c not in DERIVED_COLUMNS and c != 'product_key'
+    )
+    sql = (
+        f"INSERT INTO products ({column_list}) VALUES ({placeholders}) "
+        f"ON CONFLICT(product_key) DO UPDATE SET {assignments}"
+    )
+    rows = df.astype(object).where(pd.notna(df), None).itertuples(index=False, name=None)
+    conn.executemany(sql, rows)
+
+    incoming = set(df['product_key'])
+    stale = [
+        key for (key,) in conn.execute("SELECT product_key FROM products WHERE category = ?", (category,))
+        if key not in incoming
+    ]
+    conn.executemany("DELETE FROM products WHERE product_key = ?", [(key,) for key in stale])
+    return list(df['product_key']), stale
+
+
+def seed_incremental(conn):
+    """Re-read only the sheets whose contents changed since the last ingest."""
+    conn.execute("BEGIN")
+    ensure_ingest_files(conn)
+    ensure_product_key(conn)
+    ensure_typed_products(conn)
+    ensure_catalog_generation(conn)
+    conn.commit()
+
+    known = dict(conn.execute("SELECT path, sha256 FROM ingest_files"))
+    hashes = {path: file_hash(path) for path in files.values()}
+    changed = {category: path for category, path in files.items() if hashes[path] != known.get(path)}
+
+    if not changed:
+        print("No source files changed.")
+        return
+
+    dfs = read_categories(changed)
+
+    conn.execute("BEGIN")
+    keys = []
+    for category, df in dfs.items():
+        upserted, removed = upsert_category(conn, category, df)
+        keys += upserted + removed
+        print(f"  {category}: {len(upserted)} upserted, {len(removed)} removed")
+    refresh_derived(conn, only_missing_images=True, product_keys=keys)
+    record_hashes(conn, {path: hashes[path] for path in changed.values()})
+    conn.commit()
+
+
+# SCRAPED PRICES
+
+def seed_scraped(conn):
+    """
+    Match the scraped_prices rows (scrape_parser.py) across stores and
+    upsert them as products, replacing the products of every category the
+    dumps cover; categories without dumps keep their sheet rows.
+    """
+    conn.execute("BEGIN")
+    ensure_product_key(conn)
+    ensure_typed_products(conn)
+    ensure_catalog_generation(conn)
+    conn.commit()
+
+    matches = match_scraped(conn)
+    conn.execute("BEGIN")
+    save_matches(conn, matches)
+    by_category = {}
+    for row in scraped_products(conn):
+        by_category.setdefault(row['category'], []).append(row)
+    keys = []
+    for category, rows in by_category.items():
+        upserted, removed = upsert_category(conn, category, pd.DataFrame(rows, columns=PRODUCT_COLUMN_NAMES))
+        keys += upserted + removed
+        print(f"  {category}: {len(upserted)} upserted, {len(removed)} removed")
+    refresh_derived(conn, only_missing_images=True, product_keys=keys)
+    conn.commit()
+
+
+def seed_dumps(conn, root=SORT_ROOT):
+    """Parse the raw store dumps under root into scraped_prices, then ingest them with seed_scraped."""
+    totals = load_dumps(conn, root)
+    print(f"  Parsed {sum(totals.values())} prices from {len(totals)} dumps")
+    seed_scraped(conn)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load the Sort/*.xlsx sheets into beiradar.db")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only re-read changed sheets and upsert their rows, keeping image_url")
+    parser.add_argument('--from-dumps', action='store_true',
+                        help="build products from the raw store dumps instead of the sheets")
+    parser.add_argument('--dumps-root', default=SORT_ROOT, help="directory holding the dump category folders")
+    args = parser.parse_args()
+
+    # Insert into SQLite database
+    conn = connect_writer(DB_PATH)
+    if args.from_dumps:
+        seed_dumps(conn, args.dumps_root)
+    elif args.incremental:
+        seed_incremental(conn)
+    else:
+        seed_full(conn)
+    # Web workers map this file instead of each loading the products table
+    write_snapshot(conn, snapshot_path(DB_PATH))
+    conn.close()
+
+    print("Database updated successfully!")
@@ -0,0 +1,334 @@
+"""
+Binary catalog snapshot: the products table in one file that every web
+worker maps into memory, so N workers share one page-cache copy instead of
+each loading the table.
+
+Layout (little endian, every section 8-byte aligned):
+
+    MAGIC, header offset (u64), header length (u64)
+    column arrays: float64 (NaN = NULL), int64 (INT_NULL = NULL) or
+        uint32 ids into the string table (0 = NULL)
+    PriceTable arrays, precomputed (PriceTable.ARRAYS)
+    string table: uint64 offsets (count + 1) into UTF-8 data
+    header: JSON with the row count, section offsets, categories and the
+        products generation (schema.catalog_generation) it was written at
+
+Ingest writes it next to the database with write_snapshot(); a new file
+replaces the old one atomically, and workers notice and remap it.
+
+    python snapshot_file.py [--db beiradar.db]
+"""
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import struct
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+from pricing import STORE_KEYS, PriceTable
+from schema import DB_PATH, catalog_generation
+
+MAGIC = b'BRSNAP01'
+PREFIX = struct.Struct('<8sQQ')
+ALIGN = 8
+SUFFIX = '.snapshot'
+INT_NULL = np.iinfo(np.int64).min
+# Rows fetched and encoded at a time while writing a snapshot
+WRITE_BATCH = 10_000
+
+_DTYPES = {'float': np.float64, 'int': np.int64, 'str': np.uint32, 'json': np.uint32}
+
+
+def snapshot_path(db_path):
+    """Where the snapshot of db_path lives."""
+    return db_path + SUFFIX
+
+
+def _kind(types):
+    """How a column holding values of types (NULLs left out) is stored."""
+    if types <= {int}:
+        return 'int'
+    if types <= {int, float}:
+        return 'float'
+    if types <= {str}:
+        return 'str'
+    return 'json'
+
+
+# WRITING
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.chunks = [b'']     # id 0 stands for NULL
+
+    def add(self, text):
+        if text is None:
+            return 0
+        sid = self.ids.get(text)
+        if sid is None:
+            sid = self.ids[text] = len(self.chunks)
+            self.chunks.append(text.encode('utf-8'))
+        return sid
+
+    def arrays(self):
+        offsets = np.zeros(len(self.chunks) + 1, dtype=np.uint64)
+        np.cumsum([len(c) for c in self.chunks], out=offsets[1:])
+        return offsets, np.frombuffer(b''.join(self.chunks), dtype=np.uint8)
+
+
+def _encode(kind, values, strings):
+    if kind == 'float':
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    if kind == 'int':
+        return np.array([INT_NULL if v is None else v for v in values], dtype=np.int64)
+    if kind == 'json':
+        values = [None if v is None else json.dumps(v) for v in values]
+    return np.array([strings.add(v) for v in values], dtype=np.uint32)
+
+
+def _decode(kind, array, strings):
+    """The values _encode() turned into array, back (to re-encode them as another kind)."""
+    if kind == 'float':
+        return [None if v != v else v for v in array.tolist()]
+    if kind == 'int':
+        return [None if v == INT_NULL else v for v in array.tolist()]
+    texts = [None if sid == 0 else strings.chunks[sid].decode('utf-8') for sid in array.tolist()]
+    return texts if kind == 'str' else [None if t is None else json.loads(t) for t in texts]
+
+
+def _floats(array, kind):
+    if kind == 'int':
+        return np.where(array == INT_NULL, np.nan, array.astype(np.float64))
+    return array
+
+
+def write_snapshot(conn, path):
+    """
+    Write the products table to path as a snapshot file, atomically
+    replacing any previous one. Rows are read and encoded WRITE_BATCH at a
+    time, so only the encoded column arrays are ever held whole. Returns
+    the number of rows written.
+    """
+    # The rows and their generation are read in one transaction
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute("BEGIN")
+    try:
+        generation = catalog_generation(conn)
+        count = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        cursor = conn.execute("SELECT rowid AS id, * FROM products ORDER BY rowid")
+        names = [d[0] for d in cursor.description]
+        strings = _StringTable()
+        # Every column starts out as an all-NULL int column (what an empty table gets)
+        types = {name: set() for name in names}
+        kinds = dict.fromkeys(names, 'int')
+        columns = {name: np.full(count, INT_NULL, dtype=np.int64) for name in names}
+        start = 0
+        while True:
+            rows = cursor.fetchmany(WRITE_BATCH)
+            if not rows:
+                break
+            end = start + len(rows)
+            for i, name in enumerate(names):
+                values = [row[i] for row in rows]
+                types[name].update(map(type, values))
+                kind = _kind(types[name] - {type(None)})
+                if kind != kinds[name]:
+                    # Values the earlier rows' kind can't hold: re-encode those rows
+                    done = _decode(kinds[name], columns[name][:start], strings)
+                    kinds[name] = kind
+                    columns[name] = np.empty(count, dtype=_DTYPES[kind])
+                    columns[name][:start] = _encode(kind, done, strings)
+                columns[name][start:end] = _encode(kind, values, strings)
+            start = end
+    finally:
+        if own_transaction:
+            conn.commit()
+
+    def store_prices(suffix):
+        # One column per store, like PriceTable.from_columns
+        return np.column_stack([_floats(columns[f'{store}_{suffix}'], kinds[f'{store}_{suffix}'])
+                                for store in STORE_KEYS])
+
+    prices = PriceTable(store_prices('current'), store_prices('original'))
+    offsets, data = strings.arrays()
+    category_ids = np.unique(columns['category']).tolist() if kinds.get('category') == 'str' else []
+    categories = sorted(strings.chunks[sid].decode('utf-8') for sid in category_ids if sid)
+
+    header = {'rows': count, 'columns': [], 'prices': {}, 'categories': categories, 'generation': generation}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, 0, 0))
+
+        def section(array):
+            f.write(b'\0' * (-f.tell() % ALIGN))
+            offset = f.tell()
+            f.write(np.ascontiguousarray(array).tobytes())
+            return offset
+
+        for name, array in columns.items():
+            header['columns'].append({'name': name, 'kind': kinds[name], 'offset': section(array)})
+        for name in PriceTable.ARRAYS:
+            array = getattr(prices, name)
+            header['prices'][name] = {'offset': section(array), 'dtype': array.dtype.str, 'shape': array.shape}
+        header['strings'] = {'count': len(strings.chunks), 'offsets': section(offsets), 'data': section(data)}
+
+        encoded = json.dumps(header).encode('utf-8')
+        header_offset = section(np.frombuffer(encoded, dtype=np.uint8))
+        f.seek(0)
+        f.write(PREFIX.pack(MAGIC, header_offset, len(encoded)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+# READING
+
+class Row(dict):
+    """A products row, remembering the snapshot and position it was read from."""
+
+    __slots__ = ('snapshot', 'position')
+
+
+class _Rows(Sequence):
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def __len__(self):
+        return self._snapshot.rows
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self._snapshot.row(i) for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return self._snapshot.row(position)
+
+
+class _RowsById(Mapping):
+    def __init__(self, snapshot, ids):
+        self._snapshot = snapshot
+        self._ids = ids
+
+    def _position(self, product_id):
+        position = int(np.searchsorted(self._ids, product_id))
+        if position < len(self._ids) and self._ids[position] == product_id:
+            return position
+        return None
+
+    def __getitem__(self, product_id):
+        position = self._position(product_id)
+        if position is None:
+            raise KeyError(product_id)
+        return self._snapshot.row(position)
+
+    def __contains__(self, product_id):
+        return self._position(product_id) is not None
+
+    def __iter__(self):
+        return iter(self._ids.tolist())
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class MappedSnapshot:
+    """
+    Catalog snapshot read from a snapshot file through mmap; a drop-in for
+    catalog.CatalogSnapshot. Rows are decoded into Row dicts when accessed,
+    so a worker only holds the rows it is currently using.
+    """
+
+    def __init__(self, path, version=None, last_modified=None):
+        self.version = version
+        self.last_modified = last_modified
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < PREFIX.size:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        magic, header_offset, header_length = PREFIX.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        header = json.loads(self._mm[header_offset:header_offset + header_length])
+
+        self.rows = header['rows']
+        self.generation = header.get('generation')
+        self.categories = tuple(header['categories'])
+        strings = header['strings']
+        self._string_offsets = self._array(strings['offsets'], np.uint64, strings['count'] + 1)
+        self._string_data = strings['data']
+
+        self._columns = {}
+        self._readers = []
+        for column in header['columns']:
+            array = self._array(column['offset'], _DTYPES[column['kind']], self.rows)
+            self._columns[column['name']] = (column['kind'], array)
+            self._readers.append((column['name'], self._reader(column['kind'], array)))
+
+        self.prices = PriceTable.precomputed({
+            name: self._array(info['offset'], np.dtype(info['dtype']), int(np.prod(info['shape']))).reshape(info['shape'])
+            for name, info in header['prices'].items()
+        })
+        self.products = _Rows(self)
+        self.by_id = _RowsById(self, self._columns['id'][1])
+
+    def _array(self, offset, dtype, count):
+        return np.frombuffer(self._mm, dtype=dtype, count=count, offset=offset)
+
+    def string(self, sid):
+        start = self._string_data + self._string_offsets.item(sid)
+        end = self._string_data + self._string_offsets.item(sid + 1)
+        return self._mm[start:end].decode('utf-8')
+
+    def _reader(self, kind, array):
+        item, string = array.item, self.string
+        if kind == 'float':
+            return lambda i: None if (v := item(i)) != v else v
+        if kind == 'int':
+            return lambda i: None if (v := item(i)) == INT_NULL else v
+        if kind == 'str':
+            return lambda i: string(sid) if (sid := item(i)) else None
+        return lambda i: json.loads(string(sid)) if (sid := item(i)) else None
+
+    def row(self, position):
+        row = Row((name, read(position)) for name, read in self._readers)
+        row.snapshot = self
+        row.position = position
+        return row
+
+    def column(self, name):
+        """Every row's value of one column, without building the rows."""
+        kind, array = self._columns[name]
+        if kind == 'str':
+            ids = array.tolist()
+            text = {sid: self.string(sid) for sid in set(ids) if sid}
+            return [text.get(sid) for sid in ids]
+        read = dict(self._readers)[name]
+        return [read(i) for i in range(self.rows)]
+
+    def positions(self, products):
+        """
+        Return the row positions of products in this snapshot, or None if
+        any of them is not one of its rows.
+        """
+        if all(isinstance(p, Row) and p.snapshot is self for p in products):
+            return [p.position for p in products]
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write the catalog snapshot file web workers map into memory")
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    count = write_snapshot(conn, snapshot_path(args.db))
+    conn.close()
+    print(f"Wrote {count} products to {snapshot_path(args.db)}")
@@ -0,0 +1,285 @@
+import re
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+from db import connect_writer
+from mapper import clean_text
+from schema import DB_PATH, STORES, ensure_scraped_matches, product_key, typed_product
+from scrape_parser import parse_weight, quantity
+
+# MinHash signature length, split into BANDS bands of ROWS rows for LSH.
+# Two names whose shingle sets have Jaccard similarity s share a band with
+# probability 1 - (1 - s**ROWS)**BANDS: ~0.1 at s=0.3, ~0.65 at s=0.5, ~0.99 at s=0.7.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Candidate pairs scoring below this are not matched
+MIN_CONFIDENCE = 0.5
+# Buckets bigger than this hold near-identical generic names; pairing
+# everything in them would be quadratic, so they are skipped
+MAX_BUCKET = 500
+# Items per batch when computing signatures, bounding the temporary arrays
+SIGNATURE_CHUNK = 4096
+PAIR_CHUNK = 65536
+# Pairs whose estimated shingle similarity is below this skip exact scoring;
+# true matches sit well above it (MinHash error is ~0.06 at 64 permutations)
+MIN_ESTIMATE = 0.3
+
+# Multiply-shift hash functions (a * x + b mod 2**64, top 32 bits), one per permutation
+_rng = np.random.RandomState(20240601)
+_PERM_A = _rng.randint(0, 1 << 63, size=NUM_PERM, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+_PERM_B = _rng.randint(0, 1 << 63, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_BAND_MIX = _rng.randint(0, 1 << 63, size=ROWS, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+
+# Tokens that carry no product identity once the size is parsed out
+_SIZE_TOKEN_RE = re.compile(r'^\d+(?:\.\d+)?[a-z]*$|^x\d+$')
+_STOPWORDS = {
+    'the', 'a', 'an', 'and', 'of', 'for', 'with', 'in', 'pack', 'pk', 'pcs', 'pieces', 's',
+    'gram', 'kilogram', 'liter', 'milliliter', 'ltrs', 'lt',
+}
+
+Item = namedtuple('Item', ['id', 'store', 'category', 'product', 'weight', 'size', 'tokens', 'shingles'])
+Match = namedtuple('Match', ['category', 'product', 'weight', 'ids', 'confidence'])
+
+
+# NORMALIZATION
+
+def name_tokens(name):
+    """Identity tokens of a product name: mapper.clean_text, minus sizes and filler."""
+    return frozenset(
+        t for t in clean_text(name).split()
+        if t not in _STOPWORDS and not _SIZE_TOKEN_RE.match(t)
+    )
+
+
+def shingles(tokens):
+    """Padded character trigrams of each token, so 'dishwash' still meets 'dish washing'."""
+    grams = set()
+    for token in tokens:
+        padded = f"#{token}#"
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def make_item(row_id, store, category, product, weight):
+    tokens = name_tokens(product)
+    return Item(row_id, store, category, product, weight,
+                quantity(weight or parse_weight(product)), tokens, shingles(tokens))
+
+
+# MINHASH / LSH
+
+def signatures(items, chunk_size=SIGNATURE_CHUNK):
+    """MinHash signatures of every item's shingles as one (len(items), NUM_PERM) array."""
+    # Each distinct shingle is hashed and permuted once
+    vocabulary = {}
+    for item in items:
+        for gram in item.shingles:
+            vocabulary.setdefault(gram, len(vocabulary))
+    hashes = np.fromiter((zlib.crc32(g.encode()) for g in vocabulary), dtype=np.uint64, count=len(vocabulary))
+    # Items without shingles get the all-max signature of the extra last row
+    table = np.vstack([
+        ((hashes[:, None] * _PERM_A + _PERM_B) >> np.uint64(32)).astype(np.uint32),
+        np.full((1, NUM_PERM), np.iinfo(np.uint32).max, dtype=np.uint32),
+    ])
+    empty = len(vocabulary)
+
+    sigs = np.empty((len(items), NUM_PERM), dtype=np.uint32)
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        indices = [[vocabulary[g] for g in item.shingles] or [empty] for item in chunk]
+        counts = np.array([len(ix) for ix in indices])
+        flat = np.fromiter((i for ix in indices for i in ix), dtype=np.intp, count=int(counts.sum()))
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sigs[start:start + len(chunk)] = np.minimum.reduceat(table[flat], offsets, axis=0)
+    return sigs
+
+
+def _codes(values):
+    """Small integer code per distinct value, -1 for None."""
+    codes = {}
+    return np.array([-1 if v is None else codes.setdefault(v, len(codes)) for v in values], dtype=np.int64)
+
+
+def candidate_pairs(items, sigs):
+    """
+    (P, 2) array of index pairs i < j of items from different stores, in the
+    same category and with compatible pack sizes, that share an LSH band.
+    """
+    n = len(items)
+    stores = _codes(item.store for item in items)
+    categories = _codes(item.category for item in items)
+    sizes = _codes(item.size for item in items)
+
+    found = []
+    for band in range(BANDS):
+        # One integer per band: a wrapping weighted sum of its rows
+        keys = (sigs[:, band * ROWS:(band + 1) * ROWS].astype(np.uint64) * _BAND_MIX).sum(axis=1)
+        order = np.lexsort((keys, categories))
+        sorted_keys, sorted_categories = keys[order], categories[order]
+        boundary = np.ones(n, dtype=bool)
+        boundary[1:] = (sorted_keys[1:] != sorted_keys[:-1]) | (sorted_categories[1:] != sorted_categories[:-1])
+        starts = np.flatnonzero(boundary)
+        lengths = np.diff(np.append(starts, n))
+
+        # Every pair inside every bucket, one batch per bucket length
+        for length in np.unique(lengths):
+            if length < 2 or length > MAX_BUCKET:
+                continue
+            members = order[starts[lengths == length][:, None] + np.arange(length)]
+            a, b = np.triu_indices(length, 1)
+            i, j = members[:, a].ravel(), members[:, b].ravel()
+            # Different sizes are never the same SKU; unknown sizes pair with anything
+            keep = (stores[i] != stores[j]) & ((sizes[i] == sizes[j]) | (sizes[i] < 0) | (sizes[j] < 0))
+            found.append(np.minimum(i, j)[keep] * n + np.maximum(i, j)[keep])
+
+    if not found:
+        return np.empty((0, 2), dtype=np.int64)
+    encoded = np.unique(np.concatenate(found))
+    return np.stack([encoded // n, encoded % n], axis=1)
+
+
+def estimated_similarity(sigs, pairs, chunk_size=PAIR_CHUNK):
+    """MinHash estimate of each pair's shingle Jaccard similarity."""
+    estimate = np.empty(len(pairs))
+    for start in range(0, len(pairs), chunk_size):
+        i, j = pairs[start:start + chunk_size].T
+        estimate[start:start + len(i)] = (sigs[i] == sigs[j]).mean(axis=1)
+    return estimate
+
+
+# SCORING
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def confidence(a, b):
+    """0..1 score that two items are the same SKU; different pack sizes never match."""
+    if a.size and b.size and a.size != b.size:
+        return 0.0
+    score = 0.6 * jaccard(a.shingles, b.shingles) + 0.4 * jaccard(a.tokens, b.tokens)
+    if not (a.size and b.size):
+        score *= 0.9
+    return round(score, 3)
+
+
+def match_items(items):
+    """
+    Group items into at most one item per store, greedily joining the best
+    scoring candidate pairs first. Returns a Match per group of two or more;
+    its confidence is the weakest link that joined the group.
+    """
+    if len(items) < 2:
+        return []
+    sigs = signatures(items)
+    pairs = candidate_pairs(items, sigs)
+    pairs = pairs[estimated_similarity(sigs, pairs) >= MIN_ESTIMATE]
+
+    scored = []
+    for i, j in pairs.tolist():
+        score = confidence(items[i], items[j])
+        if score >= MIN_CONFIDENCE:
+            scored.append((score, i, j))
+    scored.sort(key=lambda s: (-s[0], s[1], s[2]))
+
+    group_of = list(range(len(items)))
+    members = {i: [i] for i in range(len(items))}
+    weakest = {}
+    for score, i, j in scored:
+        gi, gj = group_of[i], group_of[j]
+        if gi == gj:
+            continue
+        if {items[k].store for k in members[gi]} & {items[k].store for k in members[gj]}:
+            continue
+        if len(members[gi]) < len(members[gj]):
+            gi, gj = gj, gi
+        for k in members.pop(gj):
+            group_of[k] = gi
+            members[gi].append(k)
+        weakest[gi] = min(score, weakest.pop(gi, score), weakest.pop(gj, score))
+
+    matches = []
+    for group, indices in members.items():
+        if len(indices) < 2:
+            continue
+        by_store = {items[k].store: items[k] for k in indices}
+        first = next(by_store[store] for store in STORES if store in by_store)
+        matches.append(Match(
+            first.category, first.product, first.weight or parse_weight(first.product),
+            tuple(by_store[store].id if store in by_store else None for store in STORES),
+            weakest[group],
+        ))
+    matches.sort(key=lambda m: (m.category, m.product))
+    return matches
+
+
+# DATABASE
+
+def match_scraped(conn):
+    """Match the scraped_prices rows of every store against each other."""
+    rows = conn.execute("SELECT id, store, category, product, weight FROM scraped_prices")
+    return match_items([make_item(*row) for row in rows])
+
+
+def save_matches(conn, matches):
+    """Replace scraped_matches with matches. Doesn't commit."""
+    ensure_scraped_matches(conn)
+    conn.execute("DELETE FROM scraped_matches")
+    conn.executemany(
+        "INSERT INTO scraped_matches (category, product, weight, carrefour_id, naivas_id, quickmart_id, confidence) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(m.category, m.product, m.weight) + m.ids + (m.confidence,) for m in matches]
+    )
+
+
+def scraped_products(conn):
+    """
+    products rows (schema.PRODUCT_COLUMNS dicts) for the scraped prices: one
+    per scraped_matches row, priced at each of its stores, and one per
+    scraped item no other store's item matched. A name repeated within a
+    category keeps its first row.
+    """
+    prices = {
+        row[0]: row[1:] for row in conn.execute("SELECT id, current_price, original_price FROM scraped_prices")
+    }
+    store_ids = ', '.join(f'{store.lower()}_id' for store in STORES)
+    groups = conn.execute(f"SELECT category, product, weight, {store_ids} FROM scraped_matches ORDER BY id").fetchall()
+    matched = {item_id for group in groups for item_id in group[3:] if item_id is not None}
+    for item_id, store, category, product, weight in conn.execute(
+            "SELECT id, store, category, product, weight FROM scraped_prices ORDER BY id"):
+        if item_id not in matched:
+            groups.append((category, product, weight) + tuple(item_id if s == store else None for s in STORES))
+
+    rows = {}
+    for category, product, weight, *ids in groups:
+        key = product_key(category, product)
+        if key in rows:
+            continue
+        row = {'product': product, 'weight': weight or parse_weight(product), 'category': category, 'product_key': key}
+        listed = []
+        for store, item_id in zip(STORES, ids):
+            s = store.lower()
+            current, original = prices.get(item_id, (None, None))
+            row[f'{s}_current'], row[f'{s}_original'] = current, original
+            row[f'{s}_discount_%'] = round((original - current) / original, 4) if current and original else None
+            if current:
+                listed.append((current, store))
+        row['cheapest_price'], row['cheapest_store'] = min(listed) if listed else (None, None)
+        row['is_discounted_anywhere'] = int(any(row[f'{s.lower()}_discount_%'] for s in STORES))
+        rows[key] = typed_product(row)
+    return list(rows.values())
+
+
+if __name__ == '__main__':
+    conn = connect_writer(DB_PATH)
+    matches = match_scraped(conn)
+    conn.execute("BEGIN")
+    save_matches(conn, matches)
+    conn.commit()
+    conn.close()
+
+    full = sum(1 for m in matches if None not in m.ids)
+    print(f"Matched {len(matches)} products ({full} in all {len(STORES)} stores).")
@@ -0,0 +1,176 @@
+import bisect
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+MIN_QUERY_LENGTH = 2
+MAX_PRODUCTS = 10
+MAX_SUGGESTIONS = 12
+CACHE_SIZE = 1024
+# Leading bytes of each word's text the index is sorted by
+SORT_WIDTH = 24
+
+_WORD_RE = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    """Lowercase text and collapse punctuation, so 'Milk – 500ml' -> 'milk 500ml'."""
+    return ' '.join(_WORD_RE.findall((text or '').lower()))
+
+
+class SuggestionIndex:
+    """
+    Sorted prefix index over product and category names, kept in flat
+    buffers rather than one string per key. The normalized names are
+    joined into one byte string, and the offset of every word in it is
+    sorted by the text that follows (to the end of its name:
+    'brookside fresh milk', 'fresh milk', 'milk'). A bisect on the query
+    then finds the names with any word starting with it.
+    """
+
+    def __init__(self, version, product_names, categories):
+        self.version = version
+        names = []      # display text per distinct name; products first
+        seen = set()
+        for name in product_names:
+            name = (name or '').strip()
+            if name and name.lower() not in seen:
+                seen.add(name.lower())
+                names.append(name)
+        self.product_count = len(names)
+        names += [category.replace('_', ' ').title() for category in categories]
+
+        # Display names, '\n'-separated; name i is display[name_offsets[i]:name_offsets[i + 1] - 1]
+        self.display = ''.join(f'{name}\n' for name in names)
+        self.name_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum([len(name) + 1 for name in names], out=self.name_offsets[1:])
+
+        # Normalized names, '\n'-separated UTF-8, and where each name and word starts in it
+        self.text = ''.join(f'{normalize(name)}\n' for name in names).encode('utf-8')
+        data = np.frombuffer(self.text, dtype=np.uint8)
+        separator = (data == ord(' ')) | (data == ord('\n'))
+        starts = np.flatnonzero(~separator & np.r_[True, separator[:-1]])
+        name_starts = np.r_[0, np.flatnonzero(data == ord('\n'))[:-1] + 1]
+        owner = np.searchsorted(name_starts, starts, side='right') - 1
+        word_pos = np.arange(len(starts)) - np.searchsorted(starts, name_starts)[owner]
+
+        # Sort the word offsets by their first SORT_WIDTH bytes; a longer
+        # query narrows down that range by comparing the rest
+        padded = np.r_[data, np.zeros(SORT_WIDTH, dtype=np.uint8)]
+        keys = np.empty((len(starts), SORT_WIDTH), dtype=np.uint8)
+        for i in range(SORT_WIDTH):
+            keys[:, i] = padded[starts + i]
+        order = np.argsort(keys.view(f'S{SORT_WIDTH}').ravel(), kind='stable')
+        self.starts = starts[order].astype(np.int32)
+        self.owner = owner[order].astype(np.int32)
+        self.word_pos = np.minimum(word_pos[order], np.iinfo(np.uint8).max).astype(np.uint8)
+
+    def name(self, i):
+        return self.display[self.name_offsets[i]:self.name_offsets[i + 1] - 1]
+
+    def _range(self, query):
+        """(lo, hi) of the sorted word offsets whose text starts with query (UTF-8 bytes)."""
+        text, width = self.text, min(len(query), SORT_WIDTH)
+        prefix = query[:width]
+        lo = bisect.bisect_left(self.starts, prefix, key=lambda start: text[start:start + width])
+        hi = bisect.bisect_right(self.starts, prefix, lo, key=lambda start: text[start:start + width])
+        return lo, hi
+
+    def lookup(self, query):
+        """Return suggestion dicts for an already-normalized query."""
+        encoded = query.encode('utf-8')
+        lo, hi = self._range(encoded)
+        owner, word_pos = self.owner[lo:hi], self.word_pos[lo:hi]
+        if len(encoded) > SORT_WIDTH:
+            text = self.text
+            keep = [text[start:start + len(encoded)] == encoded for start in self.starts[lo:hi].tolist()]
+            owner, word_pos = owner[keep], word_pos[keep]
+        if not len(owner):
+            return []
+
+        # Keep the earliest word position each name matched at
+        order = np.lexsort((word_pos, owner))
+        owner, word_pos = owner[order], word_pos[order]
+        first = np.r_[True, owner[1:] != owner[:-1]]
+        owner, word_pos = owner[first], word_pos[first]
+
+        # Whole-name prefix matches first, then shorter (more specific) names;
+        # only the products tied with the MAX_PRODUCTS-th best are ranked by text
+        is_product = owner < self.product_count
+        products, positions = owner[is_product], word_pos[is_product]
+        lengths = self.name_offsets[products + 1] - self.name_offsets[products] - 1
+        order = np.lexsort((lengths, positions))
+        if len(order) > MAX_PRODUCTS:
+            cut = order[MAX_PRODUCTS - 1]
+            order = order[(positions[order] < positions[cut]) | (
+                (positions[order] == positions[cut]) & (lengths[order] <= lengths[cut]))]
+        ranked = sorted(
+            ((int(positions[i]), int(lengths[i]), self.name(products[i])) for i in order.tolist())
+        )[:MAX_PRODUCTS]
+        categories = sorted(self.name(i) for i in owner[~is_product].tolist())
+
+        suggestions = []
+        seen = set()
+        for kind, texts in (('product', [text for _, _, text in ranked]), ('category', categories)):
+            for text in texts:
+                if text.lower() not in seen:
+                    seen.add(text.lower())
+                    suggestions.append({'text': text, 'type': kind})
+        return suggestions[:MAX_SUGGESTIONS]
+
+
+class Suggester:
+    """
+    Autocomplete engine over a catalog.Catalog.
+    The index is rebuilt whenever the catalog snapshot changes, and hot
+    prefixes are answered from a bounded LRU cache (hits/misses count its lookups).
+    """
+
+    def __init__(self, catalog, cache_size=CACHE_SIZE):
+        self.catalog = catalog
+        self.cache_size = cache_size
+        self._index = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def index(self):
+        """Return the prefix index for the current catalog snapshot."""
+        snap = self.catalog.snapshot()
+        index = self._index
+        if index is not None and index.version == snap.version:
+            return index
+
+        with self._lock:
+            index = self._index
+            if index is None or index.version != snap.version:
+                index = SuggestionIndex(snap.version, snap.column('product'), snap.categories)
+                self._index = index
+                self._cache.clear()
+        return index
+
+    def suggest(self, query):
+        """Return up to MAX_SUGGESTIONS product and category suggestions."""
+        query = normalize(query)
+        if len(query) < MIN_QUERY_LENGTH:
+            return []
+
+        index = self.index()
+        key = (index.version, query)
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            self.misses += 1
+
+        suggestions = index.lookup(query)
+
+        with self._lock:
+            self._cache[key] = suggestions
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return suggestions
@@ -0,0 +1,351 @@
+"""
+Price-drop watchlists. A watch asks for an alert when a product drops to a
+target price at any store. Ingest calls queue_alerts() with the price
+changes it just recorded, so the work grows with the number of changes,
+not with watches x products: each price drop is one range lookup on
+watchlists(product_key, threshold_cents). Fired alerts are queued in
+alert_outbox and delivered by the worker below.
+
+Watches and alerts live in their own database next to the catalog's
+(watchlist_path), so visitors adding watches and the worker marking alerts
+sent never change the catalog file, whose version drives the web app's
+snapshot and page cache.
+
+    python watchlist.py add WATCHER PRODUCT_KEY THRESHOLD [--email ADDRESS] [--db beiradar.db]
+    python watchlist.py worker [--once] [--interval 30] [--db beiradar.db]
+
+The worker POSTs each alert as JSON to ALERT_WEBHOOK_URL when that is set,
+and prints it otherwise.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+from db import connect_writer
+from price_history import from_cents, to_cents
+from schema import DB_PATH, to_price
+
+# Alerts a worker pass takes from the outbox
+DRAIN_BATCH = 100
+# Deliveries tried per alert before the worker gives up on it
+MAX_ATTEMPTS = 5
+# Seconds between outbox polls
+POLL_INTERVAL = 30
+WEBHOOK_TIMEOUT = 10
+
+# Upper threshold bound for a price that had no previous point (newly listed)
+NO_PREVIOUS_PRICE = sys.maxsize
+
+
+# DATABASE
+
+def watchlist_path(db_path):
+    """Where the watchlist database of catalog database db_path lives."""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}-watchlists{ext or '.db'}"
+
+
+def ensure_watchlists(conn):
+    """
+    Create the watchlists, the watchers' email addresses and the alert
+    outbox. watcher is an opaque visitor id; an email address given for
+    it is only where its alerts are delivered. The (product_key,
+    threshold_cents) index lets ingest look up only the watches a price
+    change crosses. Fired alerts wait in alert_outbox until the worker
+    delivers them (sent_at set).
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS watchlists (
+            id INTEGER PRIMARY KEY,
+            watcher TEXT NOT NULL,
+            product_key TEXT NOT NULL,
+            threshold_cents INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            UNIQUE (watcher, product_key)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_watchlists_product ON watchlists(product_key, threshold_cents)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS watcher_emails (
+            watcher TEXT PRIMARY KEY,
+            email TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS alert_outbox (
+            id INTEGER PRIMARY KEY,
+            watchlist_id INTEGER NOT NULL,
+            watcher TEXT NOT NULL,
+            product_key TEXT NOT NULL,
+            store TEXT NOT NULL,
+            price_cents INTEGER NOT NULL,
+            threshold_cents INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            sent_at INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alert_outbox_pending ON alert_outbox(id) WHERE sent_at IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alert_outbox_watcher ON alert_outbox(watcher, created_at)")
+
+
+def connect_watchlists(db_path=DB_PATH):
+    """
+    Open the watchlist database of catalog database db_path, with the
+    catalog attached read-only as 'catalog' for product names. (Read-only,
+    closing it can't checkpoint the catalog's WAL and change its version.)
+    """
+    conn = connect_writer(watchlist_path(db_path))
+    ensure_watchlists(conn)
+    conn.commit()
+    conn.execute("ATTACH DATABASE ? AS catalog", (Path(db_path).resolve().as_uri() + '?mode=ro',))
+    return conn
+
+
+# EVALUATION
+
+# The watches a drop from previous to current crosses: at or above the new
+# price and below the old one, so a watch fires once per drop through it
+CROSSED_SQL = """
+    SELECT id, watcher, threshold_cents FROM watchlists
+    WHERE product_key = ? AND threshold_cents >= ? AND threshold_cents < ?
+"""
+
+
+def evaluate_changes(conn, changes, now=None):
+    """
+    Queue an alert in alert_outbox for every watch one of changes
+    (price_history.PriceChanges) took the price through. A watch crossed at
+    several stores in one run gets one alert, for the lowest price.
+    Returns the number of alerts queued. Doesn't commit.
+    """
+    now = int(time.time()) if now is None else int(now)
+    fired = {}
+    for change in changes:
+        current, previous = change.current_cents, change.previous_cents
+        if current is None or (previous is not None and current >= previous):
+            continue
+        upper = NO_PREVIOUS_PRICE if previous is None else previous
+        for watch_id, watcher, threshold in conn.execute(CROSSED_SQL, (change.product_key, current, upper)):
+            alert = (watch_id, watcher, change.product_key, change.store, current, threshold, now)
+            if watch_id not in fired or current < fired[watch_id][4]:
+                fired[watch_id] = alert
+
+    conn.executemany(
+        "INSERT INTO alert_outbox (watchlist_id, watcher, product_key, store, price_cents, threshold_cents, "
+        "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        fired.values()
+    )
+    return len(fired)
+
+
+def queue_alerts(catalog_conn, changes):
+    """
+    evaluate_changes() in the watchlist database of catalog_conn's catalog,
+    committed there at once. Returns the number of alerts queued.
+    """
+    if not changes:
+        return 0
+    db_path = next(path for _, name, path in catalog_conn.execute("PRAGMA database_list") if name == 'main')
+    conn = connect_writer(watchlist_path(db_path))
+    try:
+        ensure_watchlists(conn)
+        queued = evaluate_changes(conn, changes)
+        conn.commit()
+    finally:
+        conn.close()
+    return queued
+
+
+# WATCHES
+
+def add_watch(conn, watcher, product_key, threshold, now=None):
+    """
+    Watch product_key for watcher with a target price of threshold (KSh),
+    replacing the target of an existing watch. Doesn't commit.
+    """
+    price = to_price(threshold)
+    if price is None or not 0 < price < float('inf'):
+        raise ValueError(f"Invalid target price: {threshold!r}")
+    threshold_cents = to_cents(price)
+    now = int(time.time()) if now is None else int(now)
+    conn.execute(
+        "INSERT INTO watchlists (watcher, product_key, threshold_cents, created_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(watcher, product_key) DO UPDATE SET threshold_cents = excluded.threshold_cents",
+        (watcher, product_key, threshold_cents, now)
+    )
+
+
+def remove_watch(conn, watcher, watch_id):
+    conn.execute("DELETE FROM watchlists WHERE id = ? AND watcher = ?", (watch_id, watcher))
+
+
+def set_email(conn, watcher, email):
+    """Deliver watcher's alerts to email from now on (None stops emailing). Doesn't commit."""
+    if email:
+        conn.execute("INSERT OR REPLACE INTO watcher_emails (watcher, email) VALUES (?, ?)", (watcher, email))
+    else:
+        conn.execute("DELETE FROM watcher_emails WHERE watcher = ?", (watcher,))
+
+
+def email_of(conn, watcher):
+    row = conn.execute("SELECT email FROM watcher_emails WHERE watcher = ?", (watcher,)).fetchone()
+    return row[0] if row else None
+
+
+def watches(conn, watcher):
+    """watcher's watches, newest first, each with the id of its product (None if it left the catalog)."""
+    rows = conn.execute("""
+        SELECT w.id, w.product_key, w.threshold_cents, w.created_at, p.rowid
+        FROM watchlists AS w LEFT JOIN catalog.products AS p ON p.product_key = w.product_key
+        WHERE w.watcher = ? ORDER BY w.created_at DESC, w.id DESC
+    """, (watcher,))
+    return [
+        {'id': watch_id, 'product_key': key, 'threshold': from_cents(cents), 'created_at': created_at,
+         'product_id': product_id}
+        for watch_id, key, cents, created_at, product_id in rows
+    ]
+
+
+# Alert columns, with the product's name from the attached catalog
+ALERT_SQL = """
+    SELECT o.id, o.product_key, p.product, o.store, o.price_cents, o.threshold_cents, o.created_at, o.sent_at,
+           o.watcher, e.email
+    FROM alert_outbox AS o
+    LEFT JOIN catalog.products AS p ON p.product_key = o.product_key
+    LEFT JOIN watcher_emails AS e ON e.watcher = o.watcher
+"""
+
+
+def recent_alerts(conn, watcher, limit=20):
+    rows = conn.execute(ALERT_SQL + "WHERE o.watcher = ? ORDER BY o.created_at DESC, o.id DESC LIMIT ?",
+                        (watcher, limit))
+    return [_alert(row) for row in rows]
+
+
+def _alert(row):
+    alert_id, key, product, store, price_cents, threshold_cents, created_at, sent_at, watcher, email = row
+    return {'id': alert_id, 'product_key': key, 'product': product, 'store': store,
+            'price': from_cents(price_cents), 'threshold': from_cents(threshold_cents),
+            'created_at': created_at, 'sent_at': sent_at, 'watcher': watcher, 'email': email}
+
+
+class Watchlists:
+    """
+    Watchlist reads and writes for the web app. Each call opens its own
+    short-lived connection to the watchlist database, as watches change
+    far less often than the catalog is read.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+
+    def _run(self, action, *args):
+        conn = connect_watchlists(self.db_path)
+        try:
+            result = action(conn, *args)
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    def add(self, watcher, product_key, threshold):
+        self._run(add_watch, watcher, product_key, threshold)
+
+    def remove(self, watcher, watch_id):
+        self._run(remove_watch, watcher, watch_id)
+
+    def set_email(self, watcher, email):
+        self._run(set_email, watcher, email)
+
+    def list(self, watcher, alert_limit=20):
+        """Return (watches, recent alerts, email) of watcher."""
+        return self._run(lambda conn: (watches(conn, watcher), recent_alerts(conn, watcher, alert_limit),
+                                       email_of(conn, watcher)))
+
+
+# DELIVERY WORKER
+
+def deliver(alert, webhook_url=None):
+    """Send one alert to webhook_url as JSON, or print it when there is none."""
+    if not webhook_url:
+        print(f"[alert] {alert['email'] or alert['watcher']}: {alert['product'] or alert['product_key']} is "
+              f"KSh {alert['price']:,.0f} at {alert['store']} (target KSh {alert['threshold']:,.0f})")
+        return
+    request = urllib.request.Request(webhook_url, data=json.dumps(alert).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT):
+        pass
+
+
+def drain(conn, send=deliver, limit=DRAIN_BATCH):
+    """
+    Deliver up to limit pending alerts, oldest first, with send(alert).
+    conn is a connect_watchlists() connection. Each alert is marked sent
+    (or its failed attempt counted) and committed on its own, so a crash
+    repeats at most the delivery in flight. Returns (sent, failed).
+    """
+    rows = conn.execute(ALERT_SQL + "WHERE o.sent_at IS NULL AND o.attempts < ? ORDER BY o.id LIMIT ?",
+                        (MAX_ATTEMPTS, limit)).fetchall()
+
+    sent = failed = 0
+    for row in rows:
+        alert = _alert(row)
+        try:
+            send(alert)
+        except Exception as e:
+            print(f"Delivering alert {alert['id']} failed: {e}", file=sys.stderr)
+            conn.execute("UPDATE alert_outbox SET attempts = attempts + 1 WHERE id = ?", (alert['id'],))
+            failed += 1
+        else:
+            conn.execute("UPDATE alert_outbox SET attempts = attempts + 1, sent_at = ? WHERE id = ?",
+                         (int(time.time()), alert['id']))
+            sent += 1
+        conn.commit()
+    return sent, failed
+
+
+def run_worker(db_path, interval=POLL_INTERVAL, once=False):
+    webhook_url = os.getenv('ALERT_WEBHOOK_URL')
+    conn = connect_watchlists(db_path)
+    try:
+        while True:
+            sent, failed = drain(conn, lambda alert: deliver(alert, webhook_url))
+            if sent or failed:
+                print(f"Delivered {sent} alerts, {failed} failed.")
+            if once:
+                break
+            if sent + failed < DRAIN_BATCH:
+                time.sleep(interval)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage price-drop watches and deliver their alerts")
+    parser.add_argument('--db', default=DB_PATH, help="catalog database; watches are kept next to it")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help="watch a product for a target price")
+    add.add_argument('watcher', help="id the watch is kept under")
+    add.add_argument('product_key')
+    add.add_argument('threshold', type=float, help="target price in KSh")
+    add.add_argument('--email', help="address to deliver the watcher's alerts to")
+    worker = commands.add_parser('worker', help="deliver queued alerts")
+    worker.add_argument('--once', action='store_true', help="drain the outbox once and exit")
+    worker.add_argument('--interval', type=float, default=POLL_INTERVAL, help="seconds between polls")
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        conn = connect_watchlists(args.db)
+        add_watch(conn, args.watcher, args.product_key, args.threshold)
+        if args.email:
+            set_email(conn, args.watcher, args.email)
+        conn.commit()
+        conn.close()
+        print(f"Watching {args.product_key} for {args.watcher} at KSh {args.threshold:,.0f}.")
+    else:
+        run_worker(args.db, args.interval, args.once)
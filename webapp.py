@@ -1,113 +1,121 @@
-from flask import Flask, render_template, request, session, redirect, url_for
-from pyngrok import ngrok, conf
-import sqlite3
 import os
+import uuid
+
 from dotenv import load_dotenv
+from flask import Flask, Response, current_app, render_template, request, session, redirect, url_for, stream_template, stream_with_context, send_from_directory
+from werkzeug.local import LocalProxy
+
+from catalog import Catalog
+from suggest import Suggester
+from facets import Facets, display_name, slugify
+from fuzzy import Corrector
+from pricing import PriceTable
+from response_cache import MAX_ENTRIES, ResponseCache
+from schema import UNIT_PRICE_UNITS, decode_cursor, encode_cursor
+from image_assets import DERIVED_FOLDER, ImageManifest
+from metrics import InstrumentedConnection, Metrics
+from watchlist import Watchlists
 
-# Load environment variables
-load_dotenv()
+PORT = 5000
 
-app = Flask(__name__)
-# Use environment variable, fallback to secure default
-app.secret_key = os.getenv('SECRET_KEY', 'dev-key-change-in-production')
+STORES = ['Carrefour', 'Naivas', 'Quickmart']
 
-DB_PATH = 'beiradar.db'
-PORT = 5000
+# ?sort= orders offered on product listings (schema.SORTS), with their labels
+SORT_OPTIONS = {'price': 'Lowest price', 'unit_price': 'Lowest price per kg / L / pc', 'discount': 'Biggest discount'}
 
+MAX_DEALS_PER_PAGE = 200
+IMAGE_MAX_AGE = 365 * 24 * 3600
 
-# NGROK CONFIG
 
-NGROK_PATH = r"C:\Users\Lilian Imma W\Downloads\ngrok-v3-stable-windows-amd64\ngrok.exe"
+# APP CONFIG
+
+def default_config():
+    """Settings read from the environment (and .env); create_app(config) overrides any of them."""
+    load_dotenv()
+    return {
+        # Use environment variable, fallback to secure default
+        'SECRET_KEY': os.getenv('SECRET_KEY', 'dev-key-change-in-production'),
+        'BEIRADAR_DB': os.getenv('BEIRADAR_DB', 'beiradar.db'),
+        # Deals page size, overridable per request with ?limit=
+        'DEALS_PER_PAGE': int(os.getenv('DEALS_PER_PAGE', 60)),
+        # Product listings (home search, subcategories) are paginated with a keyset cursor
+        'PRODUCTS_PER_PAGE': int(os.getenv('PRODUCTS_PER_PAGE', 48)),
+        # Stream listing templates so the first cards go out before the rest render
+        # (also available per request with ?stream=1)
+        'STREAM_LISTINGS': os.getenv('STREAM_LISTINGS', '0') == '1',
+        # Add a Server-Timing header (app, SQL and template time) to every response
+        'SERVER_TIMING': os.getenv('SERVER_TIMING', '0') == '1',
+        # Window for "lowest recent price" on deals and the price history API
+        'PRICE_HISTORY_DAYS': int(os.getenv('PRICE_HISTORY_DAYS', 30)),
+        # 0 renders every page instead of serving cached copies
+        'PAGE_CACHE_ENTRIES': int(os.getenv('PAGE_CACHE_ENTRIES', MAX_ENTRIES)),
+        # Load the catalog and suggestion index in create_app instead of on the
+        # first request; under a preloading WSGI server workers then share it
+        'PRELOAD_CATALOG': os.getenv('PRELOAD_CATALOG', '1') == '1',
+    }
+
 
-conf.get_default().ngrok_path = NGROK_PATH
-ngrok.kill()
+class Services:
+    """The shared objects of one app, kept in app.extensions['beiradar']."""
+
+    def __init__(self, app):
+        config = app.config
+        # Read-mostly copy of the products table; its read connections
+        # report statement counts and SQLite time to the request metrics
+        self.catalog = Catalog(config['BEIRADAR_DB'], connection_factory=InstrumentedConnection)
+        self.suggester = Suggester(self.catalog)
+        self.facets = Facets(self.catalog)
+        self.corrector = Corrector(self.catalog)
+        self.watchlists = Watchlists(config['BEIRADAR_DB'])
+        self.page_cache = ResponseCache(max_entries=config['PAGE_CACHE_ENTRIES'])
+        self.image_manifest = ImageManifest(os.path.join(app.root_path, DERIVED_FOLDER, 'manifest.json'))
+
+        # Request latency, SQL and template timing on /metrics (Prometheus text format)
+        self.metrics = metrics = Metrics()
+        metrics.init_app(app, server_timing=config['SERVER_TIMING'])
+        metrics.hit_ratio('page_cache', "Page cache", self.page_cache)
+        metrics.gauge('page_cache_entries', "Pages held in the page cache.", lambda: len(self.page_cache))
+        metrics.gauge('page_cache_bytes', "Bytes of pages held in the page cache.", lambda: self.page_cache.size_bytes)
+        metrics.hit_ratio('catalog_snapshot', "Catalog snapshot (misses are reloads)", self.catalog)
+        metrics.hit_ratio('suggestion_cache', "Search suggestion cache", self.suggester)
+
+
+def _service(name):
+    return LocalProxy(lambda: getattr(current_app.extensions['beiradar'], name))
+
+# The current app's services, for the helpers and views below
+catalog = _service('catalog')
+suggester = _service('suggester')
+facets = _service('facets')
+corrector = _service('corrector')
+watchlists = _service('watchlists')
+page_cache = _service('page_cache')
+image_manifest = _service('image_manifest')
 
-public_url = ngrok.connect(PORT)
-print(f"Shareable Ngrok URL: {public_url}")
 
 # DATABASE FUNCTIONS
 
-def get_products(search_query=None, category=None, min_price=None, max_price=None, min_discount=None):
+def get_product_page(page=1, cursor=None, limit=None, **filters):
     """
-    Fetch products from the database with optional filtering.
-    Searches by BOTH product name AND category.
+    Fetch one page of the products matching filters (see schema.find_product_page).
+    Returns (products, next_cursor, total); next_cursor is None on the last page.
+    cursor continues from a previous page (keyset), otherwise page picks the offset.
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    sql = "SELECT rowid AS id, * FROM products"
-    conditions = []
-    params = []
-
-    if search_query:
-        # Search by product name OR category
-        search_lower = f"%{search_query.lower()}%"
-        conditions.append("(LOWER(product) LIKE ? OR LOWER(category) LIKE ?)")
-        params.append(search_lower)
-        params.append(search_lower)
-    
-    if category:
-        conditions.append("LOWER(category) = ?")
-        params.append(category.lower())
-
-    if conditions:
-        sql += " WHERE " + " AND ".join(conditions)
-
-    cursor.execute(sql, params)
-    rows = cursor.fetchall()
-    conn.close()
+    limit = limit or current_app.config['PRODUCTS_PER_PAGE']
+    after = decode_cursor(cursor) if cursor else None
+    products, last_key, total = catalog.find_page(
+        limit,
+        after=after,
+        offset=(page - 1) * limit,
+        **filters
+    )
+    shown = (page - 1) * limit + len(products)
+    next_cursor = encode_cursor(last_key) if last_key and shown < total else None
+    return products, next_cursor, total
 
-    products = [dict(row) for row in rows]
-    
-    # Apply price and discount filtering (post-database)
-    if min_price is not None or max_price is not None or min_discount is not None:
-        filtered = []
-        for p in products:
-            best_price, _ = calculate_best_price(p)
-            
-            # Check price range
-            if best_price:
-                if min_price is not None and best_price < min_price:
-                    continue
-                if max_price is not None and best_price > max_price:
-                    continue
-            
-            # Check discount
-            if min_discount is not None:
-                stores = ['Carrefour', 'Naivas', 'Quickmart']
-                max_product_discount = 0
-                for store in stores:
-                    store_lower = store.lower()
-                    current = p.get(f'{store_lower}_current')
-                    original = p.get(f'{store_lower}_original')
-                    
-                    if current and original and original != '–':
-                        try:
-                            curr_f = float(current)
-                            orig_f = float(original)
-                            if orig_f > curr_f:
-                                discount = (orig_f - curr_f) * 100 / orig_f
-                                max_product_discount = max(max_product_discount, discount)
-                        except:
-                            pass
-                
-                if max_product_discount < min_discount:
-                    continue
-            
-            filtered.append(p)
-        products = filtered
-    
-    return products
 def get_categories():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT DISTINCT category FROM products ORDER BY category")
-    categories = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return categories
-
-@app.context_processor
+    return list(catalog.snapshot().categories)
+
 def utility_processor():
     return dict(get_categories=get_categories)
 
@@ -115,113 +123,114 @@ def get_cart():
     """Return the cart dict from session."""
     return session.get('cart', {})
 
+def cart_badge_count():
+    """Number of distinct cart items shown in the header badge."""
+    return len(get_cart())
+
+def page_vary():
+    """Per-visitor part of cached page keys: the cart badge, plus the image
+    manifest version since pages embed derivative URLs."""
+    return cart_badge_count(), image_manifest.version
+
 def save_cart(cart):
     """Save the cart dict into session."""
     session['cart'] = cart
 
-def add_to_cart(product_name, quantity=1):
+def add_to_cart(product_id, quantity=1):
     cart = get_cart()
-    pname = str(product_name)
-    if pname in cart:
-        cart[pname] += quantity
+    pid = str(product_id)
+    if pid in cart:
+        cart[pid] += quantity
     else:
-        cart[pname] = quantity
+        cart[pid] = quantity
     save_cart(cart)
 
-def remove_from_cart(product_name):
+def remove_from_cart(product_id):
     cart = get_cart()
-    pname = str(product_name)
-    if pname in cart:
-        del cart[pname]
+    pid = str(product_id)
+    if pid in cart:
+        del cart[pid]
     save_cart(cart)
 
-def update_cart(product_name, quantity):
+def update_cart(product_id, quantity):
     cart = get_cart()
-    pname = str(product_name)
+    pid = str(product_id)
     if quantity <= 0:
-        cart.pop(pname, None)
+        cart.pop(pid, None)
     else:
-        cart[pname] = quantity
+        cart[pid] = quantity
     save_cart(cart)
 
+def resolve_cart(cart):
+    """
+    Look up every cart product by id in one pass over the catalog snapshot.
+    Carts saved before items were keyed by id hold product names; those are
+    resolved once by exact name and the cart is re-keyed.
+    """
+    by_id = catalog.snapshot().by_id
+    resolved = []
+    migrated = {}
+
+    for key, qty in cart.items():
+        if key.isdigit():
+            product = by_id.get(int(key))
+        else:
+            product = next((p for p in catalog.find(search_query=key) if p.get('product') == key), None)
+        if product:
+            resolved.append((product, qty))
+            migrated[str(product['id'])] = migrated.get(str(product['id']), 0) + qty
+
+    if migrated != cart:
+        save_cart(migrated)
+    return resolved
+
 
 # PRICE CALCULATION FUNCTIONS
 
-def calculate_best_price(product):
+def _image_path(filename):
+    return "images/" + filename.replace("images/", "").strip()
+
+
+def get_image_url(filename, size='card'):
     """
-    Calculate the best price from all stores.
-    Returns None for best_store if all prices are the same.
+    Returns the URL for a product image: its resized, content-hashed JPEG
+    when image_assets.py has built one, otherwise the original file.
     """
-    stores = [
-        ('Carrefour', product.get('carrefour_current')),
-        ('Naivas', product.get('naivas_current')),
-        ('Quickmart', product.get('quickmart_current'))
-    ]
-    
-    # Filter out invalid prices
-    valid_prices = [(store, price) for store, price in stores if price not in (None, 0)]
-    
-    if not valid_prices:
-        return None, None
-    
-    # Find the best (minimum) price
-    best_store, best_price = min(valid_prices, key=lambda x: x[1])
-    
-    # Check if all valid prices are the same
-    unique_prices = set(price for _, price in valid_prices)
-    
-    # If all prices are the same, don't highlight any store as "best"
-    if len(unique_prices) == 1:
-        return best_price, None  # Return price but no best_store
-    
-    return best_price, best_store
-
-def get_image_url(filename):
-    """Returns the correct URL for a product image."""
     if not filename:
-        return "https://via.placeholder.com/200?text=No+Image"
-    
-    filename = filename.replace("images/", "").strip()
-    return url_for('static', filename=f'images/{filename}')
+        return url_for('static', filename='placeholder.svg')
+
+    path = _image_path(filename)
+    derived = image_manifest.variant(path, size, 'jpeg')
+    if derived:
+        return url_for('derived_image', filename=derived)
+    return url_for('static', filename=path)
 
-app.jinja_env.globals.update(get_image_url=get_image_url)
+
+def get_webp_url(filename, size='card'):
+    """Returns the URL of the WebP derivative of a product image, or None."""
+    if not filename:
+        return None
+    derived = image_manifest.variant(_image_path(filename), size, 'webp')
+    return url_for('derived_image', filename=derived) if derived else None
 
 def process_products(products):
     """Process raw product data into display-friendly format"""
+    # Catalog rows reuse the snapshot's precomputed price columns; anything
+    # else (e.g. rows from an older snapshot) gets a table built for the batch
+    snap = catalog.snapshot()
+    positions = snap.positions(products)
+    if positions is None:
+        table = PriceTable.from_products(products)
+    else:
+        table = snap.prices
+
     processed = []
 
-    for p in products:
-        best_price, best_store = calculate_best_price(p)
-
-        stores_data = {}
-        for store_name in ['Carrefour', 'Naivas', 'Quickmart']:
-            store_lower = store_name.lower()
-            current = p.get(f'{store_lower}_current')
-            original_raw = p.get(f'{store_lower}_original')
-
-            if current is not None:
-                try:
-                    current = float(current)
-                except:
-                    current = None
-
-            original = None
-            if original_raw and original_raw != '–':
-                try:
-                    original = float(original_raw)
-                except:
-                    original = None
-
-            discount = 0
-            if current and original and original > current:
-                discount = round((original - current) * 100 / original, 2)
-
-            stores_data[store_name] = {
-                'current': current,
-                'original': original,
-                'discount': discount,
-                'display': f"KSh {current:,.0f}" if current else 'N/A'
-            }
+    for p, (best_price, best_store, stores_data, on_sale) in zip(products, table.rows(positions)):
+        unit = UNIT_PRICE_UNITS.get(p.get('unit_kind'), (None, None))[1]
+        for store, data in stores_data.items():
+            data['display'] = f"KSh {data['current']:,.0f}" if data['current'] else 'N/A'
+            data['unit_price'] = p.get(f'{store.lower()}_unit_price')
 
         processed.append({
             'id': p.get('id'),
@@ -230,9 +239,11 @@ def process_products(products):
             'category': p.get('category', '').replace('_', ' ').title(),
             'best_price': best_price,
             'best_store': best_store,
+            'unit_price': p.get('best_unit_price'),
+            'unit': unit,
             'stores': stores_data,
             'typical_price': p.get('cheapest_price'),
-            'on_sale': any(d['discount'] > 0 for d in stores_data.values()),
+            'on_sale': on_sale,
             'image_url': p.get('image_url', ''),
             'is_discounted': bool(p.get('is_discounted_anywhere', 0))
         })
@@ -256,10 +267,7 @@ def calculate_cart_totals_by_store(cart_items):
             store_lower = store.lower()
             price = product.get(f'{store_lower}_current')
             if price:
-                try:
-                    store_totals[store] += float(price) * quantity
-                except (ValueError, TypeError):
-                    pass
+                store_totals[store] += price * quantity
     
     valid_totals = {k: v for k, v in store_totals.items() if v > 0}
     
@@ -283,182 +291,197 @@ def calculate_cart_totals_by_store(cart_items):
 
 # ROUTES
 
-@app.route('/', methods=['GET'])
+def pagination_urls(endpoint, page, next_cursor, **view_args):
+    """Previous/next page links for a listing, keeping the current query args."""
+    args = {k: v for k, v in request.args.items() if k not in ('page', 'cursor')}
+    prev_url = url_for(endpoint, **view_args, **args, page=page - 1) if page > 1 else None
+    next_url = url_for(endpoint, **view_args, **args, page=page + 1, cursor=next_cursor) if next_cursor else None
+    return {'prev_url': prev_url, 'next_url': next_url}
+
+def listing_sort():
+    """The ?sort= of a product listing, or None unless it is one of SORT_OPTIONS."""
+    sort = request.args.get('sort')
+    return sort if sort in SORT_OPTIONS else None
+
+def render_listing(template, **context):
+    """Render a product listing, streamed when STREAM_LISTINGS is set or ?stream=1."""
+    if current_app.config['STREAM_LISTINGS'] or request.args.get('stream') == '1':
+        return Response(stream_with_context(stream_template(template, **context)))
+    return render_template(template, **context)
+
+def listing_filters():
+    """The min_price, max_price and min_discount query args of a product listing, as floats."""
+    filters = {}
+    for name in ('min_price', 'max_price', 'min_discount'):
+        value = request.args.get(name)
+        filters[name] = float(value) if value else None
+    return filters
+
+def facet_url(**changes):
+    """The current listing's URL with some query args changed (None drops one); back to page 1."""
+    args = {k: v for k, v in request.args.items() if k not in ('page', 'cursor')}
+    for name, value in changes.items():
+        if value is None:
+            args.pop(name, None)
+        else:
+            args[name] = value
+    return url_for(request.endpoint, **request.view_args, **args)
+
 def home():
     """Home route with search and filtering"""
     query = request.args.get('search', '').strip()
-    min_price = request.args.get('min_price')
-    max_price = request.args.get('max_price')
-    min_discount = request.args.get('min_discount')
-    
-    min_price = float(min_price) if min_price else None
-    max_price = float(max_price) if max_price else None
-    min_discount = float(min_discount) if min_discount else None
+    category = request.args.get('category', '').strip() or None
+    filters = listing_filters()
+    sort = listing_sort()
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    next_cursor = None
+    total = 0
+    facet_counts = None
+    corrections = []
 
     if query:
-        products = get_products(
-            search_query=query,
-            min_price=min_price,
-            max_price=max_price,
-            min_discount=min_discount
+        # Misspelled words are searched as their closest catalog words
+        search_text, corrections = corrector.expand(query)
+        products, next_cursor, total = get_product_page(
+            page=page,
+            cursor=request.args.get('cursor'),
+            search_query=search_text,
+            category=category,
+            sort=sort,
+            **filters
         )
         results = process_products(products)
+        facet_counts = facets.counts(search_query=search_text, category=category, **filters)
     else:
         results = []
 
-    return render_template(
+    return render_listing(
         'index.html',
         query=query,
+        corrections=corrections,
+        category=category,
         products=results,
-        min_price=min_price,
-        max_price=max_price,
-        min_discount=min_discount
+        total=total,
+        page=page,
+        **pagination_urls('home', page, next_cursor),
+        **filters,
+        sort=sort,
+        sort_options=SORT_OPTIONS,
+        facets=facet_counts
     )
 
-# Category mapping
-CATEGORY_MAPPING = {
-    "Rice": "Rice",
-    "Cooking Oil": "Oil",
-    "Sugar": "Sugar",
-    "Milk": "Milk",
-    "Yoghurt": "Yoghurt",
-    "Cheese": "Cheese",
-    "Laundry/Detergents": "Laundry/Detergents",
-    "Dishwashing": "Dishwashing",
-    "Paper products": "Paper products",
-    "Toothpaste": "Toothpaste",
-    "Lotion": "Lotion",
-    "Sanitary Pads": "Sanitary Pads"
-}
-
-CATEGORIES = {
-    "Foodstuff": ["Rice", "Cooking Oil", "Sugar"],
-    "Dairy": ["Milk", "Yoghurt", "Cheese"],
-    "Household": ["Laundry", "Dishwashing", "Paper products"],
-    "Personal Care": ["Toothpastes", "Lotion", "Sanitary Pads"]
-}
-
-@app.route('/api/search-suggestions')
 def search_suggestions():
     """API endpoint for autocomplete - Returns products AND categories"""
-    query = request.args.get('q', '').strip().lower()
-    
-    if not query or len(query) < 2:
-        return {'suggestions': []}
-    
-    suggestions = []
-    seen = set()
-    
-    # Get matching products
-    products = get_products(search_query=query)
-    
-    for p in products[:10]:  # Limit to 10 products
-        product_name = p.get('product', '').strip()
-        if product_name and product_name.lower() not in seen:
-            suggestions.append({
-                'text': product_name,
-                'type': 'product'
-            })
-            seen.add(product_name.lower())
-    
-    # Get matching categories
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT DISTINCT category FROM products WHERE LOWER(category) LIKE ? ORDER BY category",
-        (f"%{query}%",)
-    )
-    categories = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    
-    for category in categories:
-        category_display = category.replace('_', ' ').title()
-        if category_display.lower() not in seen:
-            suggestions.append({
-                'text': category_display,
-                'type': 'category'
-            })
-            seen.add(category_display.lower())
-    
-    # Return formatted suggestions (limit to 12 total)
+    query = request.args.get('q', '').strip()
+
+    # Served from the in-memory prefix index, never from SQLite
     return {
-        'suggestions': suggestions[:12]
+        'suggestions': suggester.suggest(query)
     }
-@app.route("/categories")
+
+def facets_api():
+    """Facet counts (category, best store, price and discount buckets) for a search or category listing"""
+    query = request.args.get('search', '').strip()
+    search_text = corrector.expand(query)[0] if query else None
+    category = request.args.get('category', '').strip() or None
+    if category:
+        category = facets.index().category_for_slug(category) or category
+    return facets.counts(search_query=search_text, category=category, **listing_filters())
+
+def price_history_api(product_id):
+    """Per-store price trajectory of one product over the last ?days=N days"""
+    product = catalog.snapshot().by_id.get(product_id)
+    if product is None:
+        return {'error': 'Product not found'}, 404
+    days = min(max(request.args.get('days', current_app.config['PRICE_HISTORY_DAYS'], type=int), 1), 365)
+    trajectory = catalog.price_trajectory(product['product_key'], days)
+    return {
+        'product': product['product'],
+        'days': days,
+        'stores': {
+            store: [{'observed_at': t, 'current': current, 'original': original} for t, current, original in points]
+            for store, points in trajectory.items()
+        },
+    }
+
+def get_departments():
+    """The catalog's categories grouped into departments, with product counts."""
+    return [
+        {
+            'name': department,
+            'slug': slugify(department),
+            'count': sum(count for _, count in categories),
+            'subcategories': [
+                {'name': display_name(category), 'slug': slugify(category), 'count': count}
+                for category, count in categories
+            ],
+        }
+        for department, categories in facets.index().departments()
+    ]
+
 def categories_list():
-    categories = [{"name": name, "slug": name.lower().replace(" ", "-")} for name in CATEGORIES.keys()]
-    return render_template("categories.html", categories=categories)
+    return render_template("categories.html", categories=get_departments())
 
-@app.route("/categories/<category_slug>")
 def category_detail(category_slug):
-    category_name = None
-    for name in CATEGORIES.keys():
-        if name.lower().replace(" ", "-") == category_slug:
-            category_name = name
-            break
-
-    if not category_name:
+    department = next((d for d in get_departments() if d['slug'] == category_slug), None)
+    if department is None:
         return "Category not found", 404
 
-    subcategories = CATEGORIES[category_name]
-    return render_template("category_detail.html", category_name=category_name, subcategories=subcategories)
+    return render_template("category_detail.html", category_name=department['name'],
+                           subcategories=department['subcategories'])
 
-@app.route('/products/<subcategory_slug>')
 def products_by_subcategory(subcategory_slug):
     """Show products in subcategory with filtering"""
-    subcategory_name = subcategory_slug.replace('-', ' ').title()
-    db_category = CATEGORY_MAPPING.get(subcategory_name, subcategory_name)
-    
-    min_price = request.args.get('min_price')
-    max_price = request.args.get('max_price')
-    min_discount = request.args.get('min_discount')
-    
-    min_price = float(min_price) if min_price else None
-    max_price = float(max_price) if max_price else None
-    min_discount = float(min_discount) if min_discount else None
-    
-    products = get_products(
+    db_category = facets.index().category_for_slug(subcategory_slug) or subcategory_slug.replace('-', ' ')
+    subcategory_name = display_name(db_category)
+    filters = listing_filters()
+    sort = listing_sort()
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    products, next_cursor, total = get_product_page(
+        page=page,
+        cursor=request.args.get('cursor'),
         category=db_category,
-        min_price=min_price,
-        max_price=max_price,
-        min_discount=min_discount
+        sort=sort,
+        **filters
     )
     results = process_products(products)
     
-    return render_template(
+    return render_listing(
         'category_products.html',
         category_name=subcategory_name,
         products=results,
-        min_price=min_price,
-        max_price=max_price,
-        min_discount=min_discount
+        total=total,
+        page=page,
+        **pagination_urls('products_by_subcategory', page, next_cursor, subcategory_slug=subcategory_slug),
+        **filters,
+        sort=sort,
+        sort_options=SORT_OPTIONS,
+        facets=facets.counts(category=db_category, **filters)
     )
 
 
 # CART ROUTES
 
-@app.route("/cart")
 def cart_view():
     """Cart view with multi-store totals"""
-    cart = get_cart()
+    resolved = resolve_cart(get_cart())
+    processed_items = process_products([product for product, _ in resolved])
     products_in_cart = []
 
-    for product_name, qty in cart.items():
-        products = get_products(search_query=product_name)
-        product = products[0] if products else None
-
-        if product:
-            processed = process_products([product])[0]
-            products_in_cart.append({
-                'name': processed['name'],
-                'quantity': qty,
-                'product_data': product,
-                'best_price': processed['best_price'],
-                'best_store': processed['best_store'],
-                'stores': processed['stores'],
-                'category': processed['category'],
-                'image_url': processed['image_url']
-            })
+    for (product, qty), processed in zip(resolved, processed_items):
+        products_in_cart.append({
+            'id': processed['id'],
+            'name': processed['name'],
+            'quantity': qty,
+            'product_data': product,
+            'best_price': processed['best_price'],
+            'best_store': processed['best_store'],
+            'stores': processed['stores'],
+            'category': processed['category'],
+            'image_url': processed['image_url']
+        })
 
     cart_summary = calculate_cart_totals_by_store(products_in_cart) if products_in_cart else {
         'by_store': {'Carrefour': 0, 'Naivas': 0, 'Quickmart': 0},
@@ -474,75 +497,126 @@ def cart_view():
         cart_summary=cart_summary
     )
 
-@app.route("/cart/add/<product_name>", methods=['POST'])
-def cart_add(product_name):
+def cart_add(product_id):
     """Add item to cart"""
     qty = int(request.form.get('quantity', 1))
-    add_to_cart(product_name, qty)
+    add_to_cart(product_id, qty)
     return redirect(request.referrer or url_for('home'))
 
-@app.route("/cart/remove/<product_name>")
-def cart_remove(product_name):
+def cart_remove(product_id):
     """Remove item from cart"""
-    remove_from_cart(product_name)
+    remove_from_cart(product_id)
     return redirect(url_for('cart_view'))
 
-@app.route("/cart/update/<product_name>", methods=['POST'])
-def cart_update(product_name):
+def cart_update(product_id):
     """Update item quantity"""
     qty = int(request.form.get('quantity', 1))
-    update_cart(product_name, qty)
+    update_cart(product_id, qty)
     return redirect(url_for('cart_view'))
 
 
+# WATCHLIST ROUTES
+
+def current_watcher(create=False):
+    """The random visitor id this visitor's watches are kept under, from the session."""
+    watcher = session.get('watcher')
+    if watcher is None and create:
+        watcher = session['watcher'] = uuid.uuid4().hex
+    return watcher
+
+def watchlist_view():
+    """The visitor's price-drop watches and their latest alerts"""
+    watcher = current_watcher()
+    watches, alerts, email = watchlists.list(watcher) if watcher else ([], [], None)
+    by_id = catalog.snapshot().by_id
+    listed = [w for w in watches if w['product_id'] in by_id]
+    for watch, product in zip(listed, process_products([by_id[w['product_id']] for w in listed])):
+        watch['product'] = product
+    return render_template("watchlist.html", watches=watches, alerts=alerts, email=email or '')
+
+def watchlist_add(product_id):
+    """Watch a product for a target price"""
+    product = catalog.snapshot().by_id.get(product_id)
+    if product is None:
+        return "Product not found", 404
+    try:
+        watchlists.add(current_watcher(create=True), product['product_key'], request.form.get('threshold'))
+    except ValueError:
+        return "Enter a target price", 400
+    return redirect(url_for('watchlist_view'))
+
+def watchlist_email():
+    """Send the visitor's alerts to an email address from now on"""
+    email = request.form.get('email', '').strip().lower()
+    if '@' not in email:
+        return "Enter an email address", 400
+    # Only a delivery address: the watches stay under the visitor id
+    watchlists.set_email(current_watcher(create=True), email)
+    return redirect(url_for('watchlist_view'))
+
+def watchlist_remove(watch_id):
+    """Stop watching a product"""
+    watcher = current_watcher()
+    if watcher:
+        watchlists.remove(watcher, watch_id)
+    return redirect(url_for('watchlist_view'))
+
+
 # OTHER ROUTES
 
-@app.route('/about')
+def derived_image(filename):
+    """Serve an image derivative; its name changes with its content, so it never needs revalidating."""
+    response = send_from_directory(os.path.join(current_app.root_path, DERIVED_FOLDER), filename, max_age=IMAGE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
 def about():
     return render_template('about.html')
 
-@app.route('/deals')
 def deals():
-    """Show best deals"""
-    products = get_products()
+    """Show best deals, read from the materialized deals table"""
+    store = request.args.get('store') or None
+    if store not in STORES:
+        store = None
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', current_app.config['DEALS_PER_PAGE'], type=int), 1), MAX_DEALS_PER_PAGE)
+    history_days = current_app.config['PRICE_HISTORY_DAYS']
+
+    rows, total = catalog.deals(store=store, limit=limit, offset=(page - 1) * limit)
+    # A deal isn't much of one if some store sold it for less recently
+    lows = catalog.lowest_prices([d['product'].get('product_key') for d in rows], days=history_days)
     deals_list = []
     
-    for p in products:
-        prices = {
-            'Carrefour': p.get('carrefour_current'),
-            'Naivas': p.get('naivas_current'),
-            'Quickmart': p.get('quickmart_current')
-        }
-        
-        valid_prices = {k: v for k, v in prices.items() if v and v > 0}
-        
-        if len(valid_prices) >= 2:
-            best_store = min(valid_prices, key=valid_prices.get)
-            best_price = valid_prices[best_store]
-            max_price = max(valid_prices.values())
-            
-            if max_price > best_price:
-                discount_pct = round((max_price - best_price) * 100 / max_price, 2)
-                
-                if discount_pct > 0:
-                    deals_list.append({
-                        'product_name': p.get('product', 'Unknown'),
-                        'weight': p.get('weight', ''),
-                        'store': best_store,
-                        'old_price': max_price,
-                        'new_price': best_price,
-                        'deal_percentage': discount_pct,
-                        'category': p.get('category', '').replace('_', ' ').title(),
-                        'image_url': p.get('image_url', '')
-                    })
+    for d in rows:
+        p = d['product']
+        deals_list.append({
+            'id': d['product_id'],
+            'product_name': p.get('product', 'Unknown'),
+            'weight': p.get('weight', ''),
+            'store': d['store'],
+            'old_price': d['old_price'],
+            'new_price': d['new_price'],
+            'deal_percentage': d['deal_percentage'],
+            'category': (p.get('category') or '').replace('_', ' ').title(),
+            'image_url': p.get('image_url', ''),
+            'recent_low': lows.get(p.get('product_key')),
+        })
     
-    deals_list = sorted(deals_list, key=lambda x: x['deal_percentage'], reverse=True)
-    return render_template('deals.html', deals=deals_list)
+    return render_template(
+        'deals.html',
+        history_days=history_days,
+        deals=deals_list,
+        total_deals=total,
+        store=store,
+        stores=STORES,
+        page=page,
+        limit=limit,
+        has_next=page * limit < total
+    )
 
 # CUSTOM FILTERS
 
 
-@app.template_filter('safe_price')
 def safe_price(value):
     """
     Safely format a price value, handling None and invalid values.
@@ -558,18 +632,100 @@ def safe_price(value):
 
 # ERROR HANDLERS
 
-@app.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
 def internal_error(e):
     return render_template('500.html'), 500
 
 
+# APP FACTORY
+
+# (rule, view, served through the page cache, add_url_rule options)
+ROUTES = [
+    ('/', home, True, {'methods': ['GET']}),
+    ('/api/search-suggestions', search_suggestions, False, {}),
+    ('/api/facets', facets_api, True, {}),
+    ('/api/price-history/<int:product_id>', price_history_api, False, {}),
+    ('/categories', categories_list, True, {}),
+    ('/categories/<category_slug>', category_detail, True, {}),
+    ('/products/<subcategory_slug>', products_by_subcategory, True, {}),
+    ('/cart', cart_view, False, {}),
+    ('/cart/add/<int:product_id>', cart_add, False, {'methods': ['POST']}),
+    ('/cart/remove/<int:product_id>', cart_remove, False, {}),
+    ('/cart/update/<int:product_id>', cart_update, False, {'methods': ['POST']}),
+    ('/watchlist', watchlist_view, False, {}),
+    ('/watchlist/add/<int:product_id>', watchlist_add, False, {'methods': ['POST']}),
+    ('/watchlist/email', watchlist_email, False, {'methods': ['POST']}),
+    ('/watchlist/remove/<int:watch_id>', watchlist_remove, False, {}),
+    ('/img/<path:filename>', derived_image, False, {}),
+    ('/about', about, False, {}),
+    ('/deals', deals, True, {}),
+]
+
+
+def create_app(config=None):
+    """
+    Build the Flask app. Nothing runs at import time: settings come from
+    default_config() updated with config, and each app gets its own catalog,
+    caches and metrics. For a WSGI server: gunicorn "webapp:create_app()".
+    """
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(config or {})
+    app.secret_key = app.config['SECRET_KEY']
+
+    services = Services(app)
+    app.extensions['beiradar'] = services
+
+    for rule, view, cached, options in ROUTES:
+        if cached:
+            view_func = services.page_cache.cached(services.catalog, vary=page_vary)(view)
+        else:
+            view_func = view
+        app.add_url_rule(rule, view.__name__, view_func, **options)
+
+    app.context_processor(utility_processor)
+    app.jinja_env.globals.update(get_image_url=get_image_url, get_webp_url=get_webp_url, facet_url=facet_url)
+    app.add_template_filter(safe_price)
+    app.register_error_handler(404, page_not_found)
+    app.register_error_handler(500, internal_error)
+
+    if app.config['PRELOAD_CATALOG']:
+        # Build the snapshot, suggestion and facet indexes before the first keystroke arrives
+        services.suggester.index()
+        services.facets.index()
+        services.corrector.index()
+    return app
+
+
 # RUN APP
 
+def start_tunnel(port):
+    """Open an ngrok tunnel to port and return its public URL."""
+    from pyngrok import conf, ngrok
+
+    # Set NGROK_PATH when the ngrok binary isn't on the PATH, e.g.
+    # C:\Users\Lilian Imma W\Downloads\ngrok-v3-stable-windows-amd64\ngrok.exe
+    ngrok_path = os.getenv('NGROK_PATH')
+    if ngrok_path:
+        conf.get_default().ngrok_path = ngrok_path
+    ngrok.kill()
+    return ngrok.connect(port)
+
+
 if __name__ == '__main__':
+    import argparse
+
+    # .env settings (USE_NGROK, NGROK_PATH) apply to the options below too
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run the BeiRadar web app")
+    parser.add_argument('--ngrok', action='store_true', default=os.getenv('USE_NGROK', '0') == '1',
+                        help="share the app through an ngrok tunnel (or set USE_NGROK=1)")
+    args = parser.parse_args()
+
+    app = create_app()
     print(f"Visit your app locally: http://127.0.0.1:{PORT}")
-    print(f"Shareable Ngrok URL: {public_url}")
-    app.run(host="0.0.0.0", port=PORT, debug=True, use_reloader=False)
\ No newline at end of file
+    if args.ngrok:
+        print(f"Shareable Ngrok URL: {start_tunnel(PORT)}")
+    app.run(host="0.0.0.0", port=PORT, debug=True, use_reloader=False)